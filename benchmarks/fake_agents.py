@@ -0,0 +1,175 @@
+import logging
+import uuid
+import pickle
+import gevent
+import zmq.green as zmq
+
+import wishful_framework as msgs
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+BENCH_UPI_TYPE = "radio"
+BENCH_MODULE = "bench"
+BENCH_FUNCTIONS = ["echo", "get_value"]
+
+
+class FakeAgentSwarm(object):
+    """N simulated agents sharing one PUB and one SUB socket.
+
+    Agents announce themselves with NewNodeMsg, send HelloMsg on demand and
+    echo every UPI call addressed to them or to a topic from their NewNodeAck.
+    """
+    def __init__(self, agentNum, dl, ul, context=None):
+        self.log = logging.getLogger("{module}.{name}".format(
+            module=self.__class__.__module__, name=self.__class__.__name__))
+
+        self.context = context or zmq.Context()
+        self.ownContext = context is None
+
+        self.ids = [str(uuid.uuid4()) for i in range(agentNum)]
+        self.idSet = set(self.ids)
+        self.groups = {}
+        self.controllerUuid = None
+
+        #received from controller
+        self.ackNum = 0
+        self.helloNum = 0
+        self.callNum = 0
+        self.responseNum = 0
+
+        #agents send in chunks, so the controller can keep up
+        self.chunkSize = 200
+
+        self.ul_socket = self.context.socket(zmq.PUB)
+        self.ul_socket.setsockopt(zmq.SNDHWM, 0)
+        self.ul_socket.setsockopt(zmq.RCVHWM, 0)
+        self.ul_socket.connect(ul)
+
+        self.dl_socket = self.context.socket(zmq.SUB)
+        self.dl_socket.setsockopt(zmq.RCVHWM, 0)
+        self.dl_socket.setsockopt(zmq.SUBSCRIBE, b"")
+        self.dl_socket.connect(dl)
+
+        self.receiver = None
+
+    def start(self):
+        self.receiver = gevent.spawn(self._receive)
+
+    def stop(self):
+        if self.receiver:
+            self.receiver.kill()
+            self.receiver = None
+        self.ul_socket.setsockopt(zmq.LINGER, 0)
+        self.dl_socket.setsockopt(zmq.LINGER, 0)
+        self.ul_socket.close()
+        self.dl_socket.close()
+        if self.ownContext:
+            self.context.term()
+
+    def _send(self, topic, cmdDesc, payload):
+        self.ul_socket.send_multipart([topic.encode("utf-8"), cmdDesc.SerializeToString(), payload])
+
+    def _send_chunked(self, frames):
+        for i, (topic, cmdDesc, payload) in enumerate(frames):
+            self.ul_socket.send_multipart([topic, cmdDesc, payload])
+            if (i + 1) % self.chunkSize == 0:
+                gevent.sleep(0)
+
+    def build_new_node_msg(self, index, agentId):
+        msg = msgs.NewNodeMsg()
+        msg.agent_uuid = agentId
+        msg.ip = "10.{}.{}.{}".format((index >> 16) & 255, (index >> 8) & 255, index & 255)
+        msg.name = "agent_{}".format(index)
+        msg.info = "fake agent"
+
+        module = msg.modules.add()
+        module.id = 0
+        module.name = BENCH_MODULE
+        for fname in BENCH_FUNCTIONS:
+            function = module.functions.add()
+            function.name = fname
+        return msg
+
+    def join(self):
+        cmdDesc = msgs.CmdDesc()
+        cmdDesc.type = msgs.get_msg_type(msgs.NewNodeMsg)
+        cmdDesc.func_name = msgs.get_msg_type(msgs.NewNodeMsg)
+        cmdDesc.serialization_type = msgs.CmdDesc.PROTOBUF
+        cmdDescBytes = cmdDesc.SerializeToString()
+
+        frames = []
+        for index, agentId in enumerate(self.ids):
+            msg = self.build_new_node_msg(index, agentId)
+            frames.append((b"NEW_NODE", cmdDescBytes, msg.SerializeToString()))
+        self._send_chunked(frames)
+
+    def send_hellos(self, timeout=9):
+        cmdDesc = msgs.CmdDesc()
+        cmdDesc.type = msgs.get_msg_type(msgs.HelloMsg)
+        cmdDesc.func_name = msgs.get_msg_type(msgs.HelloMsg)
+        cmdDesc.serialization_type = msgs.CmdDesc.PROTOBUF
+        cmdDescBytes = cmdDesc.SerializeToString()
+
+        frames = []
+        for agentId in self.ids:
+            msg = msgs.HelloMsg()
+            msg.uuid = agentId
+            msg.timeout = timeout
+            frames.append((agentId.encode("utf-8"), cmdDescBytes, msg.SerializeToString()))
+        self._send_chunked(frames)
+
+    def wait_for(self, condition, timeout=60):
+        with gevent.Timeout(timeout, False):
+            while not condition():
+                gevent.sleep(0.001)
+            return True
+        return False
+
+    def _receive(self):
+        newNodeAck = msgs.get_msg_type(msgs.NewNodeAck)
+        helloMsg = msgs.get_msg_type(msgs.HelloMsg)
+
+        while True:
+            frames = self.dl_socket.recv_multipart()
+            topic = frames[0].decode("utf-8")
+            cmdDesc = msgs.CmdDesc()
+            cmdDesc.ParseFromString(frames[1])
+
+            if cmdDesc.type == newNodeAck:
+                ack = msgs.NewNodeAck()
+                ack.ParseFromString(frames[2])
+                self.ackNum = self.ackNum + 1
+                self.controllerUuid = ack.controller_uuid
+                for groupTopic in ack.topics:
+                    self.groups.setdefault(str(groupTopic), set()).add(str(ack.agent_uuid))
+                continue
+
+            if cmdDesc.type == helloMsg:
+                self.helloNum = self.helloNum + 1
+                continue
+
+            self.callNum = self.callNum + 1
+            if topic in self.idSet:
+                agents = [topic]
+            else:
+                agents = self.groups.get(topic, ())
+            self._respond(agents, cmdDesc)
+
+    def _respond(self, agents, cmdDesc):
+        payload = pickle.dumps(cmdDesc.func_name)
+        response = msgs.CmdDesc()
+        response.type = cmdDesc.type
+        response.func_name = cmdDesc.func_name
+        response.call_id = cmdDesc.call_id
+        response.serialization_type = msgs.CmdDesc.PICKLE
+
+        for i, agentId in enumerate(agents):
+            response.caller_id = agentId
+            self._send(agentId, response, payload)
+            self.responseNum = self.responseNum + 1
+            if (i + 1) % self.chunkSize == 0:
+                gevent.sleep(0)
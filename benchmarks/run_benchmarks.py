@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""Controller hot path benchmarks against a fake agent swarm.
+
+Runs the real Controller and TransportChannel over ipc sockets in a
+temporary directory; agents are simulated in the same process, so numbers
+are meant for comparing revisions on one machine, not as absolute figures.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--agents 10,100,1000,5000] [--rounds 20]
+"""
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import gevent
+import zmq.green as zmq
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from wishful_controller import Controller, wait_all
+from fake_agents import FakeAgentSwarm, BENCH_UPI_TYPE
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+#time for zmq subscriptions to propagate before agents start talking
+CONNECT_DELAY = 0.5
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+class BenchmarkEnv(object):
+    def __init__(self, agentNum, timeout, config=None):
+        self.agentNum = agentNum
+        self.timeout = timeout
+        self.config = config or {}
+        self.tmpDir = tempfile.mkdtemp(prefix="wishful_bench_")
+        self.dl = "ipc://{}/dl".format(self.tmpDir)
+        self.ul = "ipc://{}/ul".format(self.tmpDir)
+        self.controller = None
+        self.swarm = None
+
+    def __enter__(self):
+        self.controller = Controller(dl=self.dl, ul=self.ul)
+        self.controller.load_config({"controller": self.config})
+        #agents do not answer hellos in between, keep them alive
+        self.controller.nodeManager.helloTimeout = 3600
+        #all agents share one socket pair, so a single pipe carries a whole
+        #broadcast and every per agent subscription of the controller
+        for option in (zmq.SNDHWM, zmq.RCVHWM):
+            self.controller.transport.ul_socket.setsockopt(option, 0)
+            self.controller.transport.dl_socket.setsockopt(option, 0)
+        self.controller.start()
+        gevent.sleep(0.1)
+
+        self.swarm = FakeAgentSwarm(self.agentNum, self.dl, self.ul)
+        self.swarm.start()
+        gevent.sleep(CONNECT_DELAY)
+        return self
+
+    def __exit__(self, *args):
+        self.swarm.stop()
+        self.controller.stop()
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+    def wait_for(self, condition, what):
+        if not self.swarm.wait_for(condition, self.timeout):
+            raise Exception("Timeout while waiting for {} with {} agents".format(what, self.agentNum))
+
+    def join(self):
+        nodeManager = self.controller.nodeManager
+        swarm = self.swarm
+        start = time.time()
+        swarm.join()
+        self.wait_for(lambda: len(nodeManager.nodes) == self.agentNum and swarm.ackNum == self.agentNum,
+                      "node join")
+        return time.time() - start
+
+
+def bench_join_and_calls(agentNum, rounds, timeout, config):
+    results = {}
+    with BenchmarkEnv(agentNum, timeout, config) as env:
+        controller = env.controller
+        swarm = env.swarm
+
+        duration = env.join()
+        results["join_rate"] = agentNum / duration
+
+        nodes = controller.nodeManager.nodes
+
+        #broadcast to node list, one message per node
+        latencies = []
+        for i in range(rounds):
+            start = time.time()
+            response = controller.nodes(nodes).blocking(True).timeout(timeout).exec_cmd(BENCH_UPI_TYPE, "echo")
+            latencies.append(time.time() - start)
+            if len(response) != agentNum:
+                raise Exception("Broadcast got {}/{} responses".format(len(response), agentNum))
+        results["bcast_p50"] = percentile(latencies, 50)
+        results["bcast_p95"] = percentile(latencies, 95)
+
+        #call on group, frame serialized once and sent to every member
+        group = controller.nodeManager.create_group("bench", nodes)
+        latencies = []
+        for i in range(rounds):
+            start = time.time()
+            response = controller.group(group).blocking(True).timeout(timeout).exec_cmd(BENCH_UPI_TYPE, "echo")
+            latencies.append(time.time() - start)
+            if len(response) != agentNum:
+                raise Exception("Group call got {}/{} responses".format(len(response), agentNum))
+        results["group_p50"] = percentile(latencies, 50)
+        results["group_p95"] = percentile(latencies, 95)
+
+        #responses per second, several group calls in flight
+        responseNum = swarm.responseNum
+        start = time.time()
+        futures = [controller.group(group).future().timeout(timeout).exec_cmd(BENCH_UPI_TYPE, "get_value")
+                   for i in range(rounds)]
+        done, notDone = wait_all(futures, timeout=timeout)
+        duration = time.time() - start
+        if notDone:
+            raise Exception("{} of {} calls did not finish".format(len(notDone), rounds))
+        results["responses_per_s"] = (swarm.responseNum - responseNum) / duration
+
+        #hello processing, one hello per agent, each answered by controller
+        helloNum = swarm.helloNum
+        start = time.time()
+        swarm.send_hellos()
+        env.wait_for(lambda: swarm.helloNum - helloNum >= agentNum, "hello replies")
+        results["hello_us"] = (time.time() - start) / agentNum * 1e6
+
+    return results
+
+
+def bench_memory(agentNum, timeout, config):
+    packageDir = os.path.dirname(sys.modules[Controller.__module__].__file__)
+    filters = [tracemalloc.Filter(True, os.path.join(packageDir, "*"))]
+
+    with BenchmarkEnv(agentNum, timeout, config) as env:
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot().filter_traces(filters)
+        env.join()
+        gevent.sleep(0.1)
+        after = tracemalloc.take_snapshot().filter_traces(filters)
+        tracemalloc.stop()
+
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return {"bytes_per_node": float(size) / agentNum}
+
+
+#result key, header, column width, decimals, scale
+COLUMNS = [("agents", "agents", 7, 0, 1),
+           ("join_rate", "joins/s", 10, 0, 1),
+           ("bcast_p50", "bcast p50", 10, 2, 1000),
+           ("bcast_p95", "bcast p95", 10, 2, 1000),
+           ("group_p50", "group p50", 10, 2, 1000),
+           ("group_p95", "group p95", 10, 2, 1000),
+           ("responses_per_s", "responses/s", 12, 0, 1),
+           ("hello_us", "hello us", 9, 1, 1),
+           ("bytes_per_node", "bytes/node", 11, 0, 1)]
+
+
+def print_header():
+    print(" ".join(header.rjust(width) for name, header, width, decimals, scale in COLUMNS))
+    print("(latencies in ms)")
+
+
+def print_row(row):
+    line = []
+    for name, header, width, decimals, scale in COLUMNS:
+        value = row.get(name, None)
+        if value is None:
+            line.append("-".rjust(width))
+        else:
+            line.append("{:>{}.{}f}".format(value * scale, width, decimals))
+    print(" ".join(line))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="WiSHFUL controller benchmarks")
+    parser.add_argument("--agents", default="10,100,1000,5000",
+                        help="comma separated numbers of fake agents")
+    parser.add_argument("--rounds", type=int, default=20,
+                        help="calls per latency/throughput measurement")
+    parser.add_argument("--timeout", type=float, default=60,
+                        help="max seconds to wait for any single step")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip memory per node measurement")
+    parser.add_argument("--join-window", type=float, default=0,
+                        help="controller join_window in seconds, 0 registers every join at once")
+    parser.add_argument("--subscription-mode", choices=["node", "all"], default="node",
+                        help="controller subscription_mode")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+
+    config = {"subscription_mode": args.subscription_mode}
+    if args.join_window:
+        config["join_window"] = args.join_window
+
+    print_header()
+    for agentNum in [int(n) for n in args.agents.split(",")]:
+        row = {"agents": agentNum}
+        row.update(bench_join_and_calls(agentNum, args.rounds, args.timeout, config))
+        if not args.no_memory:
+            row.update(bench_memory(agentNum, args.timeout, config))
+        print_row(row)
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
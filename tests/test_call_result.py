@@ -0,0 +1,171 @@
+import gevent
+import pytest
+
+from wishful_controller.call_result import (AsyncResultCollector, UpiCallFuture, PartialResults,
+                                            wait_all, wait_any)
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+def test_get_returns_single_result():
+    collector = AsyncResultCollector(1)
+    collector.set("n0", 5)
+    assert collector.ready
+    assert collector.get(timeout=1) == 5
+
+
+def test_get_returns_dict_for_many_nodes():
+    collector = AsyncResultCollector(2)
+    collector.set("n0", 1)
+    assert not collector.ready
+    collector.set("n1", 2)
+    assert collector.get(timeout=1) == {"n0": 1, "n1": 2}
+
+
+def test_quorum_is_ready_before_all_nodes_answer():
+    collector = AsyncResultCollector(3, quorum=2)
+    collector.set("n0", 1)
+    collector.set("n1", 2)
+    assert collector.ready
+    assert collector.get(timeout=1) == {"n0": 1, "n1": 2}
+
+
+def test_quorum_of_one_returns_result_keyed_by_node():
+    collector = AsyncResultCollector(3, quorum=1)
+    collector.set("n0", 0)
+    assert collector.get(timeout=1) == {"n0": 0}
+    assert collector.get(timeout=1) == {"n0": 0}
+
+    future = UpiCallFuture(3, quorum=1)
+    future.set("n0", 0)
+    assert future.result(timeout=1) == {"n0": 0}
+
+
+def test_results_of_nodes_not_addressed_are_ignored():
+    collector = AsyncResultCollector(2)
+    collector.set_nodes(["n0", "n1"])
+    assert not collector.set("n2", 1)
+    assert not collector.set_exception("n2", ValueError("failed"))
+    assert collector.responseNum == 0
+    assert collector.exception is None
+
+    collector.set("n0", 1)
+    collector.set("n1", 2)
+    assert collector.get(timeout=1) == {"n0": 1, "n1": 2}
+
+
+def test_quorum_is_capped_by_number_of_nodes():
+    collector = AsyncResultCollector(2, quorum=5)
+    assert collector.quorum == 2
+
+
+def test_timeout_returns_none_without_partial():
+    collector = AsyncResultCollector(2)
+    collector.set("n0", 1)
+    assert collector.get(timeout=0.01) is None
+
+
+def test_timeout_returns_partial_results():
+    collector = AsyncResultCollector(2, partial=True)
+    collector.nodes = ["n0", "n1"]
+    collector.set("n0", 1)
+    response = collector.get(timeout=0.01)
+    assert isinstance(response, PartialResults)
+    assert response == {"n0": 1}
+    assert response.missing == ["n1"]
+
+
+def test_expire_wakes_get_with_partial_results():
+    collector = AsyncResultCollector(2, partial=True)
+    collector.nodes = ["n0", "n1"]
+    collector.set("n0", 1)
+    gevent.spawn_later(0.01, collector.expire)
+    response = collector.get(timeout=1)
+    assert response.missing == ["n1"]
+
+
+def test_exception_is_raised_by_get():
+    collector = AsyncResultCollector(1)
+    collector.set_exception("n0", ValueError("failed"))
+    with pytest.raises(ValueError):
+        collector.get(timeout=1)
+
+
+def test_iter_results_streams_results_as_they_arrive():
+    collector = AsyncResultCollector(2)
+    gevent.spawn_later(0.01, collector.set, "n0", 1)
+    gevent.spawn_later(0.02, collector.set, "n1", 2)
+    assert list(collector.iter_results(timeout=1)) == [("n0", 1), ("n1", 2)]
+
+
+def test_iter_results_ends_at_quorum():
+    future = UpiCallFuture(3, quorum=2)
+    items = []
+    reader = gevent.spawn(lambda: items.extend(future.iter_results()))
+    gevent.sleep(0)
+    future.set("n0", 1)
+    future.set("n1", 2)
+    reader.join(timeout=1)
+    assert reader.dead
+    assert items == [("n0", 1), ("n1", 2)]
+
+
+def test_iter_results_on_finished_future_does_not_block():
+    future = UpiCallFuture(2)
+    future.set("n0", 1)
+    future.set("n1", 2)
+    assert len(list(future.iter_results())) == 2
+    with gevent.Timeout(1):
+        assert len(list(future.iter_results())) == 2
+
+
+def test_iter_results_ends_on_close():
+    future = UpiCallFuture(2)
+    future.set("n0", 1)
+    gevent.spawn_later(0.01, future.close)
+    with gevent.Timeout(1):
+        assert list(future.iter_results()) == [("n0", 1)]
+
+
+def test_iter_results_ends_on_expire():
+    future = UpiCallFuture(2)
+    gevent.spawn_later(0.01, future.expire)
+    with gevent.Timeout(1):
+        assert list(future.iter_results()) == []
+
+
+def test_iter_results_timeout_bounds_wait():
+    future = UpiCallFuture(2)
+    assert list(future.iter_results(timeout=0.01)) == []
+
+
+def test_future_result_and_done():
+    future = UpiCallFuture(1)
+    assert not future.done()
+    future.set("n0", 7)
+    assert future.done()
+    assert future.result(timeout=1) == 7
+
+
+def test_future_done_callback():
+    future = UpiCallFuture(1)
+    done = []
+    future.add_done_callback(done.append)
+    future.set("n0", 7)
+    gevent.sleep(0)
+    assert done == [future]
+
+
+def test_wait_all_and_wait_any():
+    first = UpiCallFuture(1)
+    second = UpiCallFuture(1)
+    gevent.spawn_later(0.01, first.set, "n0", 1)
+
+    assert wait_any([first, second], timeout=1) is first
+
+    done, notDone = wait_all([first, second], timeout=0.01)
+    assert done == [first]
+    assert notDone == [second]
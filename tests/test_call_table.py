@@ -0,0 +1,120 @@
+import gevent
+
+from wishful_controller.call_table import CallTable
+from wishful_controller.call_result import UpiCallFuture
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+def make_table():
+    expired = []
+    table = CallTable(expired.append)
+    return table, expired
+
+
+def test_call_leaves_table_when_every_node_answered():
+    table, expired = make_table()
+    call = table.add("1", "radio", "get_channel", 2, timeout=1, callback=lambda *args: None)
+    assert "1" in table
+
+    assert not table.response_received(call, "n0", 1)
+    assert table.response_received(call, "n1", 2)
+    assert "1" not in table
+    table.stop()
+
+
+def test_call_expires_at_timeout():
+    table, expired = make_table()
+    call = table.add("1", "radio", "get_channel", 2, timeout=0.01, callback=lambda *args: None)
+    gevent.sleep(0.03)
+    table.stop()
+    assert expired == [call]
+    assert len(table) == 0
+
+
+def test_removed_call_does_not_expire():
+    table, expired = make_table()
+    table.add("1", "radio", "get_channel", 1, timeout=0.01, callback=lambda *args: None)
+    table.remove("1")
+    gevent.sleep(0.03)
+    table.stop()
+    assert expired == []
+
+
+def test_blocking_call_is_not_expired_by_table():
+    table, expired = make_table()
+    table.add("1", "radio", "get_channel", 1, timeout=0.01, expire=False)
+    gevent.sleep(0.03)
+    table.stop()
+    assert expired == []
+    assert "1" in table
+
+
+def test_timeout_callback_call_keeps_results():
+    table, expired = make_table()
+    call = table.add("1", "radio", "get_channel", 2, timeout=0.01, timeoutCallback=lambda *args: None)
+    call.nodes = ["n0", "n1"]
+    table.response_received(call, "n0", 1)
+    gevent.sleep(0.03)
+    table.stop()
+    assert expired == [call]
+    assert call.results == {"n0": 1}
+    assert call.missing_nodes() == ["n1"]
+
+
+def test_remove_closes_collector():
+    table, expired = make_table()
+    future = UpiCallFuture(2)
+    table.add("1", "radio", "get_channel", 2, timeout=1, collector=future)
+    future.set("n0", 1)
+    table.remove("1")
+    table.stop()
+    with gevent.Timeout(1):
+        assert list(future.iter_results()) == [("n0", 1)]
+
+
+def test_expired_future_call_reports_collector_results():
+    table, expired = make_table()
+    future = UpiCallFuture(2)
+    call = table.add("1", "radio", "get_channel", 2, timeout=0.01,
+                     timeoutCallback=lambda *args: None, collector=future)
+    call.nodes = ["n0", "n1"]
+    future.nodes = call.nodes
+    future.set("n0", 1)
+    gevent.sleep(0.03)
+    table.stop()
+    assert expired == [call]
+    assert call.get_results() == {"n0": 1}
+    assert call.missing_nodes() == ["n1"]
+
+
+def test_call_removed_with_answers_outstanding_stays_finished_for_timeout():
+    table, expired = make_table()
+    future = UpiCallFuture(3, quorum=1)
+    table.add("1", "radio", "get_channel", 3, timeout=0.01, collector=future)
+    future.set("n0", 1)
+    table.remove("1")
+    assert table.is_finished("1")
+    gevent.sleep(0.03)
+    table.stop()
+    assert not table.is_finished("1")
+
+
+def test_expired_call_is_finished():
+    finished = []
+    table = CallTable(lambda call: finished.append(table.is_finished(call.callId)))
+    table.add("1", "radio", "get_channel", 2, timeout=0.01, callback=lambda *args: None)
+    gevent.sleep(0.015)
+    table.stop()
+    assert finished == [True]
+
+
+def test_answered_call_is_not_finished():
+    table, expired = make_table()
+    call = table.add("1", "radio", "get_channel", 1, timeout=1, callback=lambda *args: None)
+    table.response_received(call, "n0", 1)
+    table.stop()
+    assert not table.is_finished("1")
@@ -0,0 +1,109 @@
+import time
+
+import gevent
+from gevent import local
+
+from wishful_controller.callback_dispatcher import CallbackDispatcher
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+def test_callbacks_run_on_workers():
+    dispatcher = CallbackDispatcher(workers=2)
+    called = []
+    dispatcher.dispatch(called.append, 1)
+    dispatcher.dispatch(called.append, 2)
+    gevent.sleep(0.01)
+    dispatcher.stop()
+    assert sorted(called) == [1, 2]
+
+
+def test_full_queue_drops_without_blocking():
+    dispatcher = CallbackDispatcher(workers=1, queueSize=1)
+    dispatcher.start()
+    #worker parked like in a blocking UPI call
+    dispatcher.dispatch(gevent.sleep, 10)
+    gevent.sleep(0)
+
+    start = time.time()
+    assert dispatcher.dispatch(lambda: None)
+    assert not dispatcher.dispatch(lambda: None)
+    assert time.time() - start < 0.1
+    assert dispatcher.droppedNum == 1
+    dispatcher.stop()
+
+
+def test_full_queue_waits_at_most_put_timeout():
+    dispatcher = CallbackDispatcher(workers=1, queueSize=1, putTimeout=0.02)
+    dispatcher.start()
+    dispatcher.dispatch(gevent.sleep, 10)
+    gevent.sleep(0)
+    dispatcher.dispatch(lambda: None)
+
+    with gevent.Timeout(1):
+        assert not dispatcher.dispatch(lambda: None)
+    assert dispatcher.droppedNum == 1
+    dispatcher.stop()
+
+
+def test_prepare_resets_state_between_callbacks():
+    state = local.local()
+    state.value = None
+    seen = []
+
+    def reset():
+        state.value = None
+
+    def callback(value):
+        seen.append(getattr(state, "value", None))
+        state.value = value
+
+    dispatcher = CallbackDispatcher(workers=1, prepare=reset)
+    dispatcher.dispatch(callback, 1)
+    dispatcher.dispatch(callback, 2)
+    gevent.sleep(0.01)
+    dispatcher.stop()
+    assert seen == [None, None]
+
+
+def test_failing_callback_does_not_stop_worker():
+    dispatcher = CallbackDispatcher(workers=1)
+    called = []
+    dispatcher.dispatch(lambda: 1 / 0)
+    dispatcher.dispatch(called.append, 1)
+    gevent.sleep(0.01)
+    dispatcher.stop()
+    assert called == [1]
+
+
+def test_lifecycle_callbacks_are_not_dropped():
+    dispatcher = CallbackDispatcher(workers=1, queueSize=10)
+    dispatcher.start()
+    dispatcher.dispatch(gevent.sleep, 10)
+    gevent.sleep(0)
+
+    called = []
+    for i in range(100):
+        assert dispatcher.dispatch_lifecycle(called.append, i)
+    gevent.sleep(0.01)
+    dispatcher.stop()
+    assert called == list(range(100))
+    assert dispatcher.droppedNum == 0
+
+
+def test_full_response_queue_does_not_hold_lifecycle_callbacks():
+    dispatcher = CallbackDispatcher(workers=1, queueSize=1)
+    dispatcher.start()
+    dispatcher.dispatch(gevent.sleep, 10)
+    gevent.sleep(0)
+    dispatcher.dispatch(lambda: None)
+    assert not dispatcher.dispatch(lambda: None)
+
+    called = []
+    dispatcher.dispatch_lifecycle(called.append, 1)
+    gevent.sleep(0.01)
+    dispatcher.stop()
+    assert called == [1]
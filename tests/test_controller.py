@@ -0,0 +1,29 @@
+import pytest
+
+from wishful_controller import Controller
+from wishful_controller.node_manager import SUBSCRIBE_ALL, SUBSCRIBE_NODE
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+SHARD = {"name": "shard_0", "shards": ["shard_0", "shard_1"]}
+
+
+def test_config_applies_shard_before_subscription_mode():
+    controller = Controller()
+    with pytest.raises(Exception):
+        controller.load_config({"controller": {"subscription_mode": SUBSCRIBE_ALL, "shard": SHARD}})
+    assert controller.shardName == "shard_0"
+    assert controller.nodeManager.subscriptionMode == SUBSCRIBE_NODE
+
+
+def test_shard_refuses_subscribe_all():
+    controller = Controller()
+    controller.nodeManager.set_subscription_mode(SUBSCRIBE_ALL)
+    with pytest.raises(Exception):
+        controller.set_shard(SHARD["name"], SHARD["shards"])
+    assert controller.shardRing is None
+    assert controller.nodeManager.nodeFilter is None
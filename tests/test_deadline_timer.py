@@ -0,0 +1,107 @@
+import time
+
+import gevent
+
+from wishful_controller.deadline_timer import DeadlineTimer
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+def make_timer():
+    fired = []
+    timer = DeadlineTimer(fired.append)
+    return timer, fired
+
+
+def test_fires_in_deadline_order():
+    timer, fired = make_timer()
+    timer.schedule("b", 0.02)
+    timer.schedule("a", 0.01)
+    gevent.sleep(0.05)
+    timer.stop()
+    assert fired == ["a", "b"]
+    assert len(timer) == 0
+
+
+def test_cancelled_key_does_not_fire():
+    timer, fired = make_timer()
+    timer.schedule("a", 0.01)
+    timer.cancel("a")
+    gevent.sleep(0.03)
+    timer.stop()
+    assert fired == []
+    assert "a" not in timer
+
+
+def test_moving_deadline_later_postpones_callback():
+    timer, fired = make_timer()
+    timer.schedule("a", 0.01)
+    timer.schedule("a", 0.05)
+    gevent.sleep(0.03)
+    assert fired == []
+    gevent.sleep(0.05)
+    timer.stop()
+    assert fired == ["a"]
+
+
+def test_moving_deadline_earlier_wakes_timer():
+    timer, fired = make_timer()
+    timer.schedule("a", 10)
+    timer.schedule("a", 0.01)
+    gevent.sleep(0.03)
+    timer.stop()
+    assert fired == ["a"]
+
+
+def test_failing_callback_does_not_stop_timer():
+    fired = []
+
+    def callback(key):
+        fired.append(key)
+        if key == "a":
+            raise Exception("failed")
+
+    timer = DeadlineTimer(callback)
+    timer.schedule("a", 0.01)
+    timer.schedule("b", 0.02)
+    gevent.sleep(0.05)
+    timer.stop()
+    assert fired == ["a", "b"]
+
+
+def test_wall_clock_step_does_not_fire_deadlines(monkeypatch):
+    timer, fired = make_timer()
+    timer.schedule("a", 10)
+    gevent.sleep(0)
+
+    wallClock = time.time
+    monkeypatch.setattr(time, "time", lambda: wallClock() + 3600)
+    timer.schedule("b", 0.01)
+    gevent.sleep(0.03)
+    timer.stop()
+    assert fired == ["b"]
+    assert "a" in timer
+
+
+def test_cancelled_keys_do_not_accumulate_in_heap():
+    timer, fired = make_timer()
+    for i in range(1000):
+        timer.schedule(i, 300)
+        timer.cancel(i)
+    timer.schedule("live", 300)
+    assert len(timer._heap) <= 2 * len(timer) + DeadlineTimer.COMPACT_SLACK
+    timer.stop()
+
+
+def test_compaction_keeps_live_deadlines():
+    timer, fired = make_timer()
+    timer.schedule("a", 0.02)
+    for i in range(200):
+        timer.schedule(i, 300)
+        timer.cancel(i)
+    gevent.sleep(0.05)
+    timer.stop()
+    assert fired == ["a"]
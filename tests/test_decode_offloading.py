@@ -0,0 +1,60 @@
+import pickle
+
+import gevent
+import wishful_framework as msgs
+
+from wishful_controller.transport_channel import TransportChannel
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+def response_frames(agentId, payload):
+    cmdDesc = msgs.CmdDesc()
+    cmdDesc.type = "radio"
+    cmdDesc.func_name = "get_samples"
+    cmdDesc.caller_id = agentId
+    cmdDesc.serialization_type = msgs.CmdDesc.PICKLE
+    return [agentId.encode("utf-8"), cmdDesc.SerializeToString(), pickle.dumps(payload)]
+
+
+def exit_frames(agentId):
+    cmdDesc = msgs.CmdDesc()
+    cmdDesc.type = msgs.get_msg_type(msgs.NodeExitMsg)
+    cmdDesc.func_name = msgs.get_msg_type(msgs.NodeExitMsg)
+    cmdDesc.serialization_type = msgs.CmdDesc.PROTOBUF
+    msg = msgs.NodeExitMsg()
+    msg.agent_uuid = agentId
+    msg.reason = "stopped"
+    return [b"NODE_EXIT", cmdDesc.SerializeToString(), msg.SerializeToString()]
+
+
+def receive(transport, frames):
+    batch = []
+    if not transport._offload_msg(frames, batch):
+        batch.append(transport.parse_msg(frames))
+    if batch:
+        transport._deliver(batch)
+
+
+def test_node_exit_waits_for_offloaded_response_of_same_agent():
+    transport = TransportChannel(None)
+    delivered = []
+    transport.set_recv_callback(lambda msgContainer: delivered.append(msgContainer[0]))
+    transport.set_decode_offloading(threshold=1024)
+
+    try:
+        receive(transport, response_frames("agent_1", list(range(10000))))
+        receive(transport, exit_frames("agent_2"))
+        receive(transport, exit_frames("agent_1"))
+        assert delivered == ["NODE_EXIT"]
+
+        with gevent.Timeout(5):
+            while len(delivered) < 3:
+                gevent.sleep(0.01)
+        assert delivered == ["NODE_EXIT", "agent_1", "NODE_EXIT"]
+        assert not transport.decodeOffloader.has_pending()
+    finally:
+        transport.stop()
@@ -0,0 +1,54 @@
+import uuid
+
+import pytest
+
+from wishful_controller.hash_ring import HashRing
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+SHARDS = ["shard_0", "shard_1", "shard_2"]
+KEYS = [str(uuid.UUID(int=i)) for i in range(1000)]
+
+
+def test_empty_ring_raises():
+    with pytest.raises(Exception):
+        HashRing().get_shard("a")
+
+
+def test_mapping_is_stable():
+    first = HashRing(SHARDS)
+    second = HashRing(reversed(SHARDS))
+    assert [first.get_shard(key) for key in KEYS] == [second.get_shard(key) for key in KEYS]
+
+
+def test_every_shard_gets_keys():
+    ring = HashRing(SHARDS)
+    assert set(ring.get_shard(key) for key in KEYS) == set(SHARDS)
+    assert ring.shards == SHARDS
+
+
+def test_removing_shard_moves_only_its_keys():
+    ring = HashRing(SHARDS)
+    before = dict((key, ring.get_shard(key)) for key in KEYS)
+    ring.remove_shard("shard_1")
+    assert "shard_1" not in ring.shards
+
+    for key in KEYS:
+        if before[key] != "shard_1":
+            assert ring.get_shard(key) == before[key]
+        else:
+            assert ring.get_shard(key) in ("shard_0", "shard_2")
+
+
+def test_adding_shard_takes_keys_only_for_itself():
+    ring = HashRing(SHARDS[:2])
+    before = dict((key, ring.get_shard(key)) for key in KEYS)
+    ring.add_shard("shard_2")
+
+    for key in KEYS:
+        shard = ring.get_shard(key)
+        assert shard == before[key] or shard == "shard_2"
@@ -0,0 +1,222 @@
+import uuid
+
+import gevent
+import pytest
+import wishful_framework as msgs
+
+from wishful_controller import Controller
+from wishful_controller.node_manager import Node, SUBSCRIBE_ALL, SUBSCRIBE_NODE
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+def new_node_msg(ip="10.0.0.1", name="node"):
+    msg = msgs.NewNodeMsg()
+    msg.agent_uuid = str(uuid.uuid4())
+    msg.ip = ip
+    msg.name = name
+    msg.info = "test node"
+    return msg
+
+
+@pytest.fixture
+def nodeManager():
+    controller = Controller()
+    yield controller.nodeManager
+    controller.nodeManager.stop()
+    controller.callbackDispatcher.stop()
+
+
+def test_ip_and_name_map_to_first_node(nodeManager):
+    first = Node(new_node_msg("10.0.0.1", "node"))
+    second = Node(new_node_msg("10.0.0.1", "node"))
+    nodeManager.restore_nodes([first, second])
+
+    assert nodeManager.get_node_by_ip("10.0.0.1") is first
+    assert nodeManager.get_node_by_name("node") is first
+    assert nodeManager.get_node_by_id(second.id) is second
+    assert nodeManager.nodes == [first, second]
+
+
+def test_removing_indexed_node_promotes_next_one(nodeManager):
+    nodes = [Node(new_node_msg("10.0.0.1", "node_{}".format(i % 2))) for i in range(3)]
+    nodeManager.restore_nodes(nodes)
+
+    nodeManager.remove_node_hello_timer(nodes[0])
+    assert nodeManager.get_node_by_ip("10.0.0.1") is nodes[1]
+    assert nodeManager.get_node_by_name("node_0") is nodes[2]
+    assert nodeManager.get_node_by_name("node_1") is nodes[1]
+
+    nodeManager.remove_node_hello_timer(nodes[1])
+    assert nodeManager.get_node_by_ip("10.0.0.1") is nodes[2]
+    assert nodeManager.get_node_by_name("node_1") is None
+
+    nodeManager.remove_node_hello_timer(nodes[2])
+    assert nodeManager.get_node_by_ip("10.0.0.1") is None
+    assert nodeManager.get_node_by_name("node_0") is None
+    assert nodeManager.nodes == []
+
+
+def test_removing_shadowed_node_keeps_index(nodeManager):
+    first = Node(new_node_msg("10.0.0.1", "node"))
+    second = Node(new_node_msg("10.0.0.1", "node"))
+    nodeManager.restore_nodes([first, second])
+
+    nodeManager.remove_node_hello_timer(second)
+    assert nodeManager.get_node_by_ip("10.0.0.1") is first
+    assert nodeManager.get_node_by_name("node") is first
+    assert not nodeManager.is_node_known(second)
+
+
+def test_get_node_by_str_prefers_ip_then_id_then_name(nodeManager):
+    byIp = Node(new_node_msg("10.0.0.1", "a"))
+    byName = Node(new_node_msg("10.0.0.2", "10.0.0.1"))
+    nodeManager.restore_nodes([byName, byIp])
+
+    assert nodeManager.get_node_by_str("10.0.0.1") is byIp
+    assert nodeManager.get_node_by_str(byName.id) is byName
+    assert nodeManager.get_node_by_str("a") is byIp
+    assert nodeManager.get_node_by_str(byIp) is byIp
+    assert nodeManager.get_node_by_str("unknown") is None
+
+
+def join(nodeManager, msg):
+    return nodeManager.add_node(["NEW_NODE", None, msg.SerializeToString()])
+
+
+def leave(nodeManager, msg):
+    exitMsg = msgs.NodeExitMsg()
+    exitMsg.agent_uuid = msg.agent_uuid
+    exitMsg.reason = "test"
+    nodeManager.remove_node(["NODE_EXIT", None, exitMsg.SerializeToString()])
+
+
+@pytest.fixture
+def acks(nodeManager, monkeypatch):
+    sent = []
+    transport = nodeManager.controller.transport
+    monkeypatch.setattr(transport, "send_downlink_frames_batch",
+                        lambda batch: sent.append([agentId for agentId, frames in batch]))
+    monkeypatch.setattr(transport, "send_downlink_frames", lambda agentId, frames: sent.append([agentId]))
+    return sent
+
+
+def test_join_window_registers_nodes_in_one_batch(nodeManager, acks):
+    joined = []
+    nodeManager.add_new_node_callback(joined.append)
+    nodeManager.set_join_window(0.02)
+    msgList = [new_node_msg("10.0.0.{}".format(i)) for i in range(3)]
+    for msg in msgList:
+        join(nodeManager, msg)
+    assert nodeManager.nodes == []
+    assert acks == []
+
+    gevent.sleep(0.05)
+    ids = [msg.agent_uuid for msg in msgList]
+    assert [node.id for node in nodeManager.nodes] == ids
+    assert acks == [ids]
+    assert [node.id for node in joined] == ids
+
+
+def test_full_join_batch_is_registered_at_once(nodeManager, acks):
+    nodeManager.set_join_window(10, 2)
+    join(nodeManager, new_node_msg())
+    assert nodeManager.nodes == []
+    join(nodeManager, new_node_msg())
+    assert len(nodeManager.nodes) == 2
+    assert len(acks) == 1
+
+
+def test_repeated_join_while_pending_is_ignored(nodeManager, acks):
+    nodeManager.set_join_window(10)
+    msg = new_node_msg()
+    join(nodeManager, msg)
+    assert join(nodeManager, msg) is None
+    nodeManager.flush_joins()
+    assert len(nodeManager.nodes) == 1
+    assert acks == [[msg.agent_uuid]]
+
+
+def test_exit_while_pending_drops_join(nodeManager, acks):
+    nodeManager.set_join_window(10)
+    staying = new_node_msg()
+    leaving = new_node_msg()
+    join(nodeManager, staying)
+    join(nodeManager, leaving)
+    leave(nodeManager, leaving)
+    nodeManager.flush_joins()
+    assert [node.id for node in nodeManager.nodes] == [staying.agent_uuid]
+
+
+def test_closing_join_window_flushes_pending_joins(nodeManager, acks):
+    nodeManager.set_join_window(10)
+    join(nodeManager, new_node_msg())
+    nodeManager.set_join_window(0)
+    assert len(nodeManager.nodes) == 1
+
+    join(nodeManager, new_node_msg())
+    assert len(nodeManager.nodes) == 2
+    assert len(acks) == 2
+
+
+def test_known_node_rejoin_is_acked_again(nodeManager, acks):
+    msg = new_node_msg()
+    node = join(nodeManager, msg)
+    assert join(nodeManager, msg) is node
+    assert len(nodeManager.nodes) == 1
+    assert acks == [[msg.agent_uuid], [msg.agent_uuid]]
+
+
+def test_node_exit_drops_its_subscription(nodeManager, acks):
+    transport = nodeManager.controller.transport
+    msg = new_node_msg()
+    join(nodeManager, msg)
+    assert msg.agent_uuid in transport.subscriptions
+
+    leave(nodeManager, msg)
+    assert msg.agent_uuid not in transport.subscriptions
+    assert nodeManager.nodes == []
+
+
+def test_subscribe_all_checks_topics_against_known_nodes(nodeManager, acks):
+    transport = nodeManager.controller.transport
+    known = new_node_msg()
+    join(nodeManager, known)
+
+    nodeManager.set_subscription_mode(SUBSCRIBE_ALL)
+    assert "" in transport.subscriptions
+    assert known.agent_uuid not in transport.subscriptions
+    assert transport.topicFilter(known.agent_uuid)
+    assert transport.topicFilter(nodeManager.controller.uuid)
+    assert transport.topicFilter("NEW_NODE")
+    assert not transport.topicFilter(str(uuid.uuid4()))
+
+    joined = new_node_msg()
+    join(nodeManager, joined)
+    assert joined.agent_uuid not in transport.subscriptions
+    assert transport.topicFilter(joined.agent_uuid)
+
+    leave(nodeManager, known)
+    assert not transport.topicFilter(known.agent_uuid)
+
+
+def test_back_to_node_subscriptions(nodeManager, acks):
+    transport = nodeManager.controller.transport
+    nodeManager.set_subscription_mode(SUBSCRIBE_ALL)
+    msg = new_node_msg()
+    join(nodeManager, msg)
+
+    nodeManager.set_subscription_mode(SUBSCRIBE_NODE)
+    assert "" not in transport.subscriptions
+    assert msg.agent_uuid in transport.subscriptions
+    assert transport.topicFilter is None
+
+
+def test_subscribe_all_refused_with_node_filter(nodeManager):
+    nodeManager.set_node_filter(lambda agentId: True)
+    with pytest.raises(Exception):
+        nodeManager.set_subscription_mode(SUBSCRIBE_ALL)
+    assert nodeManager.subscriptionMode == SUBSCRIBE_NODE
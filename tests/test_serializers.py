@@ -0,0 +1,103 @@
+import pytest
+
+from wishful_controller.serializers import (PickleSerializer, ProtobufSerializer, MsgpackSerializer,
+                                            decode_payload)
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+class FakeCmdDesc(object):
+    def __init__(self, pb_full_name=""):
+        self.pb_full_name = pb_full_name
+
+
+class FakePbMsg(object):
+    def __init__(self, data=b""):
+        self.data = data
+
+    def SerializeToString(self):
+        return self.data
+
+
+PLAIN = {"channel": 6, "power": 1.5, "name": "wlan0", "raw": b"\x00\x01",
+         "list": [1, 2, 3], "tuple": (1, "a"), "nested": {1: [None, True]}}
+
+
+def test_pickle_roundtrip():
+    serializer = PickleSerializer()
+    assert serializer.loads(serializer.dumps(PLAIN), FakeCmdDesc()) == PLAIN
+
+
+def test_pickle_falls_back_to_dill_for_lambdas():
+    serializer = PickleSerializer()
+    function = serializer.loads(serializer.dumps(lambda x: x + 1), FakeCmdDesc())
+    assert function(1) == 2
+
+
+def test_pickle_frames_roundtrip():
+    serializer = PickleSerializer()
+    data, buffers = serializer.dumps_frames(PLAIN)
+    assert decode_payload(serializer, data, buffers, FakeCmdDesc()) == PLAIN
+
+
+def test_protobuf_resolves_class_by_full_name():
+    resolved = []
+
+    def resolve_class(data, typ):
+        resolved.append((data, typ))
+        return typ
+
+    serializer = ProtobufSerializer(resolve_class)
+    data = serializer.dumps(FakePbMsg(b"abc"))
+    assert serializer.can_encode(FakePbMsg())
+    assert not serializer.can_encode(PLAIN)
+    assert serializer.loads(data, FakeCmdDesc("pkg.Msg")) == "pkg.Msg"
+    assert resolved == [(b"abc", "pkg.Msg")]
+
+
+def test_protobuf_without_full_name_returns_raw_data():
+    serializer = ProtobufSerializer(None)
+    assert serializer.loads(b"abc", FakeCmdDesc()) == b"abc"
+
+
+msgpackOnly = pytest.mark.skipif(not MsgpackSerializer.available(), reason="msgpack not installed")
+
+
+@msgpackOnly
+def test_msgpack_roundtrip_keeps_tuples_and_bytes():
+    serializer = MsgpackSerializer()
+    assert serializer.can_encode(PLAIN)
+    assert serializer.loads(serializer.dumps(PLAIN), FakeCmdDesc()) == PLAIN
+
+
+@msgpackOnly
+def test_msgpack_rejects_objects():
+    serializer = MsgpackSerializer()
+    assert not serializer.can_encode({"obj": object()})
+    assert not serializer.can_encode(set([1]))
+
+
+@msgpackOnly
+def test_msgpack_checks_limited_number_of_items():
+    serializer = MsgpackSerializer()
+    assert not serializer.can_encode(list(range(MsgpackSerializer.MAX_CHECKED_ITEMS + 1)))
+
+
+@msgpackOnly
+def test_msgpack_numpy_arrays_inline_and_as_frames():
+    numpy = pytest.importorskip("numpy")
+    serializer = MsgpackSerializer()
+    obj = {"samples": numpy.arange(12, dtype=numpy.float32).reshape(3, 4)}
+    assert serializer.can_encode(obj)
+
+    decoded = serializer.loads(serializer.dumps(obj), FakeCmdDesc())
+    assert (decoded["samples"] == obj["samples"]).all()
+
+    data, buffers = serializer.dumps_frames(obj)
+    assert len(buffers) == 1
+    decoded = decode_payload(serializer, data, [bytes(b) for b in buffers], FakeCmdDesc())
+    assert decoded["samples"].shape == (3, 4)
+    assert (decoded["samples"] == obj["samples"]).all()
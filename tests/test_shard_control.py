@@ -0,0 +1,153 @@
+import uuid
+
+import gevent
+import pytest
+import wishful_framework as msgs
+
+from wishful_controller import Controller, ShardedController
+from wishful_controller.call_result import PartialResults
+from wishful_controller.node_manager import Node, HELLO_MODE_BROADCAST, HELLO_MODE_REPLY
+from wishful_controller.shard_control import ShardServer
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+SHARDS = ["shard_0", "shard_1"]
+
+
+def new_node_msg(index):
+    msg = msgs.NewNodeMsg()
+    msg.agent_uuid = str(uuid.uuid4())
+    msg.ip = "10.0.0.{}".format(index)
+    msg.name = "node_{}".format(index)
+    msg.info = "test node"
+
+    module = msg.modules.add()
+    module.id = 0
+    module.name = "global_module"
+    module.functions.add().name = "get_info"
+    return msg
+
+
+@pytest.fixture
+def shards(tmp_path):
+    #shard controllers owning 2 nodes each, serving control requests
+    controllers = []
+    for index, shardName in enumerate(SHARDS):
+        controller = Controller()
+        controller.set_shard(shardName, SHARDS)
+        controller.shardServer = ShardServer(controller, "ipc://{}/{}".format(tmp_path, shardName))
+        controller.shardServer.start()
+        controller.nodeManager.restore_nodes([Node(new_node_msg(2*index + i)) for i in range(2)])
+        controllers.append(controller)
+    yield controllers
+    for controller in controllers:
+        controller.shardServer.stop()
+        controller.nodeManager.stop()
+        controller.callTable.stop()
+        controller.callbackDispatcher.stop()
+
+
+@pytest.fixture
+def front(shards):
+    front = ShardedController([controller.shardServer.endpoint for controller in shards], refreshInterval=0)
+    front.start()
+    yield front
+    front.stop()
+
+
+def test_node_view_merges_shards(shards, front):
+    view = front.nodeManager
+    assert len(view.nodes) == 4
+    for shard, controller in zip(front.shards, shards):
+        for node in controller.nodeManager.nodes:
+            frontNode = view.get_node_by_id(node.id)
+            assert view.get_owner(frontNode) is shard
+            assert view.get_node_by_ip(node.ip) is frontNode
+            assert view.get_node_by_str(node.name) is frontNode
+            assert frontNode.profile is node.profile
+
+
+def test_refresh_keeps_known_nodes_and_drops_left_ones(shards, front):
+    view = front.nodeManager
+    staying, leaving = shards[0].nodeManager.nodes
+    stayingNode = view.get_node_by_id(staying.id)
+
+    shards[0].nodeManager.remove_node_hello_timer(leaving)
+    front.refresh()
+    assert view.get_node_by_id(staying.id) is stayingNode
+    assert view.get_node_by_id(leaving.id) is None
+    assert len(view.nodes) == 3
+
+
+def test_silent_nodes_give_partial_results(front):
+    nodes = front.nodeManager.nodes
+    results = front.nodes(nodes).timeout(0.2).radio.get_info()
+    assert isinstance(results, PartialResults)
+    assert len(results) == 0
+    assert set(results.missing) == set(nodes)
+
+
+def test_unsupported_function_raises(front):
+    with pytest.raises(Exception):
+        front.nodes(front.nodeManager.nodes).timeout(0.2).radio.set_channel(6)
+
+
+def test_unknown_node_raises(front):
+    with pytest.raises(Exception):
+        front.node("unknown").timeout(0.2).radio.get_info()
+
+
+def test_unreachable_shard_times_out(tmp_path):
+    front = ShardedController(["ipc://{}/none".format(tmp_path)], refreshInterval=0)
+    front.start()
+    try:
+        with pytest.raises(Exception):
+            front.shards[0].request(("nodes",), timeout=0.1)
+    finally:
+        front.stop()
+
+
+def test_shard_refuses_hello_broadcast():
+    controller = Controller()
+    controller.nodeManager.set_hello_mode(HELLO_MODE_BROADCAST)
+    try:
+        with pytest.raises(Exception):
+            controller.set_shard(SHARDS[0], SHARDS)
+        assert controller.shardRing is None
+    finally:
+        controller.nodeManager.stop()
+
+
+def test_hello_broadcast_refused_with_node_filter():
+    controller = Controller()
+    controller.set_shard(SHARDS[0], SHARDS)
+    with pytest.raises(Exception):
+        controller.nodeManager.set_hello_mode(HELLO_MODE_BROADCAST)
+    assert controller.nodeManager.helloMode == HELLO_MODE_REPLY
+
+
+def test_sharded_snapshot_restore_sends_hello_per_node(tmp_path, monkeypatch):
+    controller = Controller()
+    nodes = [Node(new_node_msg(i)) for i in range(3)]
+    controller.nodeManager.restore_nodes(nodes)
+    path = str(tmp_path / "snapshot.pkl")
+    controller.save_snapshot(path)
+    controller.nodeManager.helloTimer.stop()
+
+    restored = Controller()
+    restored.set_shard(SHARDS[0], [SHARDS[0]])
+    sent = []
+    transport = restored.transport
+    monkeypatch.setattr(transport, "send_downlink_frames_batch",
+                        lambda batch: sent.extend(agentId for agentId, frames in batch))
+    monkeypatch.setattr(transport, "send_downlink_frames", lambda agentId, frames: sent.append(agentId))
+    monkeypatch.setattr("wishful_controller.controller.RESTORE_HELLO_DELAY", 0)
+
+    restored.load_snapshot(path)
+    gevent.sleep(0.01)
+    assert sorted(sent) == sorted(node.id for node in nodes)
+    restored.nodeManager.helloTimer.stop()
@@ -0,0 +1,73 @@
+import uuid
+
+import wishful_framework as msgs
+
+from wishful_controller import Controller
+from wishful_controller.node_manager import Node, CapabilityProfile
+from wishful_controller.snapshot import ControllerSnapshot
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+def new_node_msg(index):
+    msg = msgs.NewNodeMsg()
+    msg.agent_uuid = str(uuid.uuid4())
+    msg.ip = "10.0.0.{}".format(index)
+    msg.name = "node_{}".format(index)
+    msg.info = "test node"
+
+    module = msg.modules.add()
+    module.id = 0
+    module.name = "radio_module"
+    module.functions.add().name = "set_channel"
+    module.generators.add().name = "rssi"
+
+    module = msg.modules.add()
+    module.id = 1
+    module.name = "global_module"
+    module.functions.add().name = "get_info"
+
+    iface = msg.interfaces.add()
+    iface.id = 0
+    iface.name = "wlan0"
+    ifaceModule = iface.modules.add()
+    ifaceModule.id = 0
+    ifaceModule.name = "radio_module"
+    return msg
+
+
+def test_save_load_round_trip(tmp_path):
+    controller = Controller()
+    announced = [new_node_msg(i) for i in range(3)]
+    nodes = [Node(msg) for msg in announced]
+    controller.nodeManager.restore_nodes(nodes)
+    controller.nodeManager.create_group("group", nodes[:2])
+    profileNum = CapabilityProfile.profile_num()
+
+    path = str(tmp_path / "snapshot.pkl")
+    ControllerSnapshot(controller).save(path)
+
+    restored = Controller()
+    ControllerSnapshot(restored).load(path)
+    nodeManager = restored.nodeManager
+
+    assert restored.uuid == controller.uuid
+    assert CapabilityProfile.profile_num() == profileNum
+    for msg, node in zip(announced, nodes):
+        restoredNode = nodeManager.get_node_by_id(node.id)
+        restoredMsg = restoredNode.to_msg()
+        assert [m.SerializeToString() for m in restoredMsg.modules] == \
+            [m.SerializeToString() for m in msg.modules]
+        assert [i.SerializeToString() for i in restoredMsg.interfaces] == \
+            [i.SerializeToString() for i in msg.interfaces]
+        assert restoredNode.profile is node.profile
+        assert (restoredNode.ip, restoredNode.name, restoredNode.info) == (node.ip, node.name, node.info)
+
+    group = nodeManager.get_group_by_name("group")
+    assert [node.id for node in group.nodes] == [node.id for node in nodes[:2]]
+
+    controller.nodeManager.helloTimer.stop()
+    nodeManager.helloTimer.stop()
@@ -0,0 +1,78 @@
+import pickle
+
+import gevent
+import pytest
+import zmq.green as zmq
+import wishful_framework as msgs
+
+from wishful_controller.transport_channel import TransportChannel
+from wishful_controller.serializers import PickleSerializer, PICKLE_OOB
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+@pytest.fixture
+def transport():
+    transport = TransportChannel(None)
+    transport.set_uplink("inproc://uplink")
+    transport.set_downlink("inproc://downlink")
+    transport.start()
+    transport.subscribe_to("agent_1")
+    received = []
+    transport.set_recv_callback(received.append)
+    transport.received = received
+
+    agent = transport.context.socket(zmq.PUB)
+    agent.connect("inproc://uplink")
+    transport.agent = agent
+    gevent.sleep(0.05)
+
+    yield transport
+
+    agent.setsockopt(zmq.LINGER, 0)
+    agent.close()
+    transport.stop()
+
+
+def send_response(transport, payload, buffers=()):
+    cmdDesc = msgs.CmdDesc()
+    cmdDesc.type = "radio"
+    cmdDesc.func_name = "get_samples"
+    cmdDesc.caller_id = "agent_1"
+    cmdDesc.serialization_type = msgs.CmdDesc.PICKLE
+    transport.agent.send_multipart([b"agent_1", cmdDesc.SerializeToString(), payload] + list(buffers))
+
+
+def receive(transport, num):
+    with gevent.Timeout(1):
+        while len(transport.received) < num:
+            transport.start_receiving()
+
+
+def test_receives_three_frame_message(transport):
+    send_response(transport, pickle.dumps({"channel": 6}))
+    receive(transport, 1)
+
+    dest, cmdDesc, msg = transport.received[0]
+    assert dest == "agent_1"
+    assert cmdDesc.func_name == "get_samples"
+    assert msg == {"channel": 6}
+
+
+@pytest.mark.skipif(not PICKLE_OOB, reason="pickle protocol 5 not available")
+def test_out_of_band_buffers_are_used_without_copy(transport):
+    numpy = pytest.importorskip("numpy")
+    samples = numpy.arange(1024 * 256, dtype=numpy.float32)
+    payload, buffers = PickleSerializer().dumps_frames({"samples": samples})
+    assert len(buffers) == 1
+
+    send_response(transport, payload, buffers)
+    receive(transport, 1)
+
+    received = transport.received[0][2]["samples"]
+    assert (received == samples).all()
+    #array is a view of the received zmq frame
+    assert not received.flags.owndata
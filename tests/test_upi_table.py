@@ -0,0 +1,154 @@
+import uuid
+
+import pytest
+import wishful_framework as msgs
+
+from wishful_controller.node_manager import Node
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+SUPPORTED = "supported"
+GENERATOR = "generator"
+FORBIDDEN = "forbidden"
+UNSUPPORTED = "unsupported"
+#old lookup failed with KeyError for iface it could not map to modules
+NO_IFACE_MODULES = "no_iface_modules"
+
+
+def linear_lookup(node, iface, fname):
+    #lookup done on every call before the UPI table was precomputed
+    if iface:
+        ifaceId = node.get_iface_id(str(iface))
+        if ifaceId not in node.iface_to_modules:
+            return NO_IFACE_MODULES
+        moduleIds = node.iface_to_modules[ifaceId]
+    else:
+        moduleIds = node.modules_without_iface
+
+    for moduleId in moduleIds:
+        if moduleId in node.functions and fname in node.functions[moduleId]:
+            return SUPPORTED
+        if moduleId in node.generators and fname in node.generators[moduleId]:
+            return GENERATOR
+
+    if iface:
+        for moduleId in node.modules_without_iface:
+            if moduleId in node.functions and fname in node.functions[moduleId]:
+                return FORBIDDEN
+            if moduleId in node.generators and fname in node.generators[moduleId]:
+                return FORBIDDEN
+
+    return UNSUPPORTED
+
+
+def table_lookup(node, iface, fname):
+    try:
+        node.is_upi_supported(iface=iface, upi_type="radio", fname=fname)
+    except Exception as e:
+        if "is generator" in str(e):
+            return GENERATOR
+        if "cannot be called with iface" in str(e):
+            return FORBIDDEN
+        return UNSUPPORTED
+    return SUPPORTED
+
+
+def make_node(modules, interfaces):
+    #modules: [(id, name, functions, generators)], interfaces: [(id, name, module ids)]
+    msg = msgs.NewNodeMsg()
+    msg.agent_uuid = str(uuid.uuid4())
+    msg.ip = "10.0.0.1"
+    msg.name = "node"
+    msg.info = "test node"
+
+    for moduleId, name, functions, generators in modules:
+        module = msg.modules.add()
+        module.id = moduleId
+        module.name = name
+        for fname in functions:
+            module.functions.add().name = fname
+        for gname in generators:
+            module.generators.add().name = gname
+
+    for ifaceId, name, moduleIds in interfaces:
+        iface = msg.interfaces.add()
+        iface.id = ifaceId
+        iface.name = name
+        for moduleId in moduleIds:
+            iface.modules.add().id = moduleId
+    return Node(msg)
+
+
+NODES = {
+    "first_module_wins": make_node(
+        [(0, "a", ["f"], ["g"]), (1, "b", ["g"], ["f"]), (2, "c", ["f", "g"], [])],
+        [(0, "wlan0", [0, 1]), (1, "wlan1", [1, 0])]),
+    "function_and_generator_in_module": make_node(
+        [(0, "a", ["f"], ["f", "g"]), (1, "b", [], ["h"]), (2, "c", ["h"], [])],
+        [(0, "wlan0", [0, 1, 2])]),
+    "duplicate_iface_names": make_node(
+        [(0, "a", ["f"], []), (1, "b", ["g"], []), (2, "c", ["global_f"], ["global_g"])],
+        [(0, "wlan0", [0]), (1, "wlan0", [1]), (2, "wlan1", [1])]),
+    "iface_without_modules": make_node(
+        [(0, "a", ["f"], []), (1, "b", ["global_f"], [])],
+        [(0, "wlan0", [0]), (1, "mon0", [])]),
+    "no_interfaces": make_node(
+        [(0, "a", ["f"], ["g"]), (1, "b", ["f", "h"], [])],
+        []),
+}
+
+IFACES = [None, "", "wlan0", "wlan1", "mon0", "unknown"]
+FNAMES = ["f", "g", "h", "global_f", "global_g", "missing"]
+
+
+@pytest.mark.parametrize("name", sorted(NODES))
+def test_table_matches_linear_lookup(name):
+    node = NODES[name]
+    for iface in IFACES:
+        for fname in FNAMES:
+            expected = linear_lookup(node, iface, fname)
+            got = table_lookup(node, iface, fname)
+            if expected == NO_IFACE_MODULES:
+                #old lookup raised KeyError, table raises a proper error
+                assert got != SUPPORTED, (iface, fname)
+            else:
+                assert got == expected, (iface, fname)
+
+
+def test_first_module_wins():
+    node = NODES["first_module_wins"]
+    assert table_lookup(node, "wlan0", "f") == SUPPORTED
+    assert table_lookup(node, "wlan0", "g") == GENERATOR
+    assert table_lookup(node, "wlan1", "f") == GENERATOR
+    assert table_lookup(node, "wlan1", "g") == SUPPORTED
+    assert table_lookup(node, None, "f") == SUPPORTED
+
+
+def test_function_shadows_generator_of_same_module():
+    node = NODES["function_and_generator_in_module"]
+    assert table_lookup(node, "wlan0", "f") == SUPPORTED
+    assert table_lookup(node, "wlan0", "g") == GENERATOR
+    assert table_lookup(node, "wlan0", "h") == GENERATOR
+
+
+def test_first_of_duplicate_iface_names_wins():
+    node = NODES["duplicate_iface_names"]
+    assert table_lookup(node, "wlan0", "f") == SUPPORTED
+    assert table_lookup(node, "wlan0", "g") == UNSUPPORTED
+    assert table_lookup(node, "wlan1", "g") == SUPPORTED
+    assert table_lookup(node, "wlan0", "global_f") == FORBIDDEN
+    assert table_lookup(node, "wlan0", "global_g") == FORBIDDEN
+    assert table_lookup(node, None, "global_f") == SUPPORTED
+    assert table_lookup(node, None, "global_g") == GENERATOR
+
+
+def test_unknown_iface_and_iface_without_modules_are_unsupported():
+    node = NODES["iface_without_modules"]
+    assert table_lookup(node, "unknown", "f") == UNSUPPORTED
+    assert table_lookup(node, "mon0", "f") == UNSUPPORTED
+    assert table_lookup(node, "wlan0", "f") == SUPPORTED
+    assert table_lookup(node, None, "global_f") == SUPPORTED
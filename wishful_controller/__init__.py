@@ -1 +1,3 @@
-from .controller import *
\ No newline at end of file
+from .controller import *
+from .sharding import ShardForwarder
+from .shard_control import ShardedController
@@ -0,0 +1,104 @@
+from gevent.local import local
+
+__author__ = "Piotr Gawlowicz, Mikolaj Chwalisz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "{gawlowicz, chwalisz}@tkn.tu-berlin.de"
+
+
+class _PendingCallContext(local):
+    #class attribute is visible in every greenlet
+    ctx = None
+
+
+pending_call_context = _PendingCallContext()
+
+
+class CallContext(object):
+    """Options of one UPI call, built with the fluent interface.
+
+    Every setter returns a new context, so a context can be kept and reused
+    from several greenlets, e.g. controller.node(n).iface("wlan0").radio.set_channel(6).
+    Accessing a UPI (radio, net, mgmt, ...) hands the context to the next
+    exec_cmd of the calling greenlet.
+    """
+    __slots__ = ("controller", "_scope", "_iface", "_exec_time", "_delay",
+                 "_timeout", "_blocking", "_callback", "_timeout_callback",
+                 "_future", "_quorum", "_partial_results")
+
+    def __init__(self, controller):
+        self.controller = controller
+        self._scope = None
+        self._iface = None
+        self._exec_time = None
+        self._delay = None
+        self._timeout = None
+        self._blocking = True
+        self._callback = None
+        self._timeout_callback = None
+        self._future = False
+        self._quorum = None
+        self._partial_results = False
+
+    def _replace(self, name, value):
+        ctx = CallContext.__new__(CallContext)
+        for slot in CallContext.__slots__:
+            setattr(ctx, slot, getattr(self, slot))
+        setattr(ctx, name, value)
+        #keep it pending, so controller.node(n) followed by controller.radio works
+        pending_call_context.ctx = ctx
+        return ctx
+
+    def activate(self):
+        pending_call_context.ctx = self
+        return self
+
+    def __getattr__(self, name):
+        #UPIs and modules of controller, called with this context
+        if name.startswith("__"):
+            raise AttributeError(name)
+        pending_call_context.ctx = self
+        return getattr(self.controller, name)
+
+    @property
+    def scope(self):
+        return self._scope
+
+    def group(self, group):
+        return self._replace("_scope", self.controller.nodeManager.get_group_by_str(group))
+
+    def node(self, node):
+        return self._replace("_scope", node)
+
+    def nodes(self, nodelist):
+        return self._replace("_scope", nodelist)
+
+    def iface(self, iface):
+        return self._replace("_iface", iface)
+
+    def exec_time(self, exec_time):
+        return self._replace("_exec_time", exec_time)
+
+    def delay(self, delay):
+        return self._replace("_delay", delay)
+
+    def timeout(self, value):
+        return self._replace("_timeout", value)
+
+    def blocking(self, value=True):
+        return self._replace("_blocking", value)
+
+    def callback(self, callback):
+        return self._replace("_callback", callback)
+
+    def timeout_callback(self, callback):
+        return self._replace("_timeout_callback", callback)
+
+    def future(self, value=True):
+        return self._replace("_future", value)
+
+    def quorum(self, value):
+        return self._replace("_quorum", value)
+
+    def partial_results(self, value=True):
+        return self._replace("_partial_results", value)
@@ -0,0 +1,201 @@
+import logging
+import gevent
+from gevent.event import AsyncResult, Event
+
+__author__ = "Piotr Gawlowicz, Mikolaj Chwalisz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "{gawlowicz, chwalisz}@tkn.tu-berlin.de"
+
+
+class PartialResults(dict):
+    """Results of nodes that answered in time, missing lists the others."""
+    def __init__(self, results, missing):
+        dict.__init__(self, results)
+        self.missing = missing
+
+
+class AsyncResultCollector(object):
+    """Collects per-node results of one UPI call.
+
+    Results can be streamed with iter_results() as they land. With quorum
+    the call is ready once that many nodes answered; with partial a timed
+    out get() returns PartialResults instead of None.
+    """
+    def __init__(self, callNum, quorum=None, partial=False):
+        self.log = logging.getLogger("{module}.{name}".format(
+            module=self.__class__.__module__, name=self.__class__.__name__))
+        self.callNum = callNum
+        self.quorum = min(quorum, callNum) if quorum else callNum
+        self.partial = partial
+        self.nodes = None
+        self._nodeSet = None
+        self.results = {}
+        self.responseNum = 0
+        self.ready = False
+        self.expired = False
+        #no more results will be delivered: ready, expired or call removed
+        self.closed = False
+        self.exception = None
+        self.asyncResult = AsyncResult()
+        #(node, result) in arrival order, replaced event wakes iterators
+        self._arrivals = []
+        self._arrivalEvent = Event()
+
+    def set_nodes(self, nodes):
+        #nodes the call was sent to, answers of other nodes are ignored
+        self.nodes = nodes
+        self._nodeSet = set(nodes)
+
+    def missing_nodes(self):
+        if self.nodes is None:
+            return []
+        return [n for n in self.nodes if n not in self.results]
+
+    def partial_response(self):
+        return PartialResults(self.results, self.missing_nodes())
+
+    def return_response(self):
+        if self.exception:
+            raise self.exception
+
+        #with quorum below callNum a single result is still keyed by node
+        if self.callNum > 1:
+            return self.results
+        return next(iter(self.results.values()))
+
+    def get(self, block=True, timeout=None):
+        if self.ready:
+            return self.return_response()
+
+        try:
+            self.log.debug("Waiting for result in blocking call")
+            self.asyncResult.get(timeout=timeout)
+        except gevent.timeout.Timeout as e:
+            if self.partial:
+                return self.partial_response()
+            return None
+
+        if not self.ready:
+            #expired before enough nodes answered
+            return self.partial_response() if self.partial else None
+        return self.return_response()
+
+    def _notify(self):
+        event, self._arrivalEvent = self._arrivalEvent, Event()
+        event.set()
+
+    def accepts(self, node):
+        if self._nodeSet is not None and node not in self._nodeSet:
+            self.log.debug("Result of node: %s not addressed by call ignored", node)
+            return False
+        return True
+
+    def _add_result(self, node, msg):
+        self.results[node] = msg
+        self.responseNum = self.responseNum + 1
+        self._arrivals.append((node, msg))
+
+        if self.responseNum == self.quorum:
+            self.ready = True
+            self.asyncResult.set()
+            #call leaves call table once ready, later answers are dropped
+            self.close()
+        else:
+            self._notify()
+
+    def set_exception(self, node, e):
+        if not self.accepts(node):
+            return False
+        self.exception = e
+        self._add_result(node, e)
+        return True
+
+    def set(self, node, msg):
+        if not self.accepts(node):
+            return False
+        self._add_result(node, msg)
+        return True
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._notify()
+
+    def expire(self):
+        #deadline passed, finish with whatever arrived
+        self.expired = True
+        if not self.asyncResult.ready():
+            self.asyncResult.set()
+        self.close()
+
+    def iter_results(self, timeout=None):
+        #every iterator starts from first result; timeout bounds wait for each
+        index = 0
+        while True:
+            while index < len(self._arrivals):
+                yield self._arrivals[index]
+                index = index + 1
+
+            if self.closed:
+                return
+
+            if not self._arrivalEvent.wait(timeout=timeout):
+                return
+
+
+class UpiCallFuture(AsyncResultCollector):
+    """Result of a UPI call that does not block the caller.
+
+    Per-node results can be consumed as they arrive with iter_results(),
+    many futures can be combined with wait_all, wait_any and as_completed.
+    """
+    def done(self):
+        return self.asyncResult.ready()
+
+    def add_done_callback(self, fn):
+        #called from hub, fn must not block
+        self.asyncResult.rawlink(lambda asyncResult: fn(self))
+
+    def result(self, timeout=None):
+        try:
+            self.asyncResult.get(timeout=timeout)
+        except gevent.timeout.Timeout as e:
+            return None
+
+        if self.exception:
+            raise self.exception
+
+        if not self.ready:
+            return self.partial_response()
+
+        if not self.results:
+            return None
+
+        if self.callNum > 1:
+            return dict(self.results)
+        return next(iter(self.results.values()))
+
+
+def wait_all(futures, timeout=None):
+    futures = list(futures)
+    gevent.wait([f.asyncResult for f in futures], timeout=timeout)
+    done = [f for f in futures if f.done()]
+    notDone = [f for f in futures if not f.done()]
+    return done, notDone
+
+
+def wait_any(futures, timeout=None):
+    futures = list(futures)
+    gevent.wait([f.asyncResult for f in futures], timeout=timeout, count=1)
+    for f in futures:
+        if f.done():
+            return f
+    return None
+
+
+def as_completed(futures, timeout=None):
+    byResult = dict((id(f.asyncResult), f) for f in futures)
+    asyncResults = [f.asyncResult for f in byResult.values()]
+    for asyncResult in gevent.iwait(asyncResults, timeout=timeout):
+        yield byResult[id(asyncResult)]
@@ -0,0 +1,139 @@
+import logging
+from .deadline_timer import DeadlineTimer, monotonic
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+class PendingCall(object):
+    __slots__ = ("callId", "upiType", "fname", "callNum", "responseNum",
+                 "nodes", "results", "callback", "timeoutCallback",
+                 "collector", "timeout", "startTime")
+
+    def __init__(self, callId, upiType, fname, callNum):
+        self.callId = callId
+        self.upiType = upiType
+        self.fname = fname
+        self.callNum = callNum
+        self.responseNum = 0
+        self.nodes = None
+        self.results = None
+        self.callback = None
+        self.timeoutCallback = None
+        self.collector = None
+        self.timeout = None
+        self.startTime = monotonic()
+
+    def is_complete(self):
+        return self.responseNum >= self.callNum
+
+    def responses_outstanding(self):
+        collector = self.collector
+        responseNum = collector.responseNum if collector else self.responseNum
+        return responseNum < self.callNum
+
+    def get_results(self):
+        #future and blocking calls keep results in their collector
+        if self.collector:
+            return self.collector.results
+        return self.results or {}
+
+    def missing_nodes(self):
+        if self.nodes is None:
+            return []
+        results = self.get_results()
+        return [n for n in self.nodes if n not in results]
+
+
+class CallTable(object):
+    """UPI calls waiting for responses, expired by a single timer.
+
+    Entries leave the table when every node answered or when their
+    deadline passes, so lost responses do not leak entries. Ids of calls
+    that left with answers outstanding are kept for another timeout, so
+    late answers are dropped instead of reaching function callbacks.
+    """
+    def __init__(self, expiredCallback=None, defaultTimeout=300):
+        self.log = logging.getLogger("{module}.{name}".format(
+            module=self.__class__.__module__, name=self.__class__.__name__))
+
+        self.expiredCallback = expiredCallback
+        self.defaultTimeout = defaultTimeout
+        self._calls = {}
+        self._timer = DeadlineTimer(self._expire, name="CallTimer")
+        self._finished = set()
+        self._finishedTimer = DeadlineTimer(self._finished.discard, name="FinishedCallTimer")
+
+    def __len__(self):
+        return len(self._calls)
+
+    def __contains__(self, callId):
+        return callId in self._calls
+
+    def stop(self):
+        self._timer.stop()
+        self._finishedTimer.stop()
+
+    def add(self, callId, upiType, fname, callNum, timeout=None, callback=None,
+            timeoutCallback=None, collector=None, expire=True):
+        call = PendingCall(callId, upiType, fname, callNum)
+        call.callback = callback
+        call.timeoutCallback = timeoutCallback
+        call.collector = collector
+        call.timeout = timeout
+        if timeoutCallback:
+            call.results = {}
+
+        self._calls[callId] = call
+
+        #blocking calls wait with their own timeout and are removed by caller
+        if expire:
+            self._timer.schedule(callId, timeout or self.defaultTimeout)
+        return call
+
+    def get(self, callId):
+        return self._calls.get(callId, None)
+
+    def is_finished(self, callId):
+        return callId in self._finished
+
+    def _finish(self, call):
+        if call.responses_outstanding():
+            self._finished.add(call.callId)
+            self._finishedTimer.schedule(call.callId, call.timeout or self.defaultTimeout)
+
+    def remove(self, callId):
+        self._timer.cancel(callId)
+        call = self._calls.pop(callId, None)
+        if call is None:
+            return None
+
+        self._finish(call)
+        if call.collector:
+            #no more results for it, end result streams
+            call.collector.close()
+        return call
+
+    def response_received(self, call, node, msg):
+        call.responseNum = call.responseNum + 1
+        if call.results is not None:
+            call.results[node] = msg
+
+        if call.is_complete():
+            self.remove(call.callId)
+            return True
+        return False
+
+    def _expire(self, callId):
+        call = self._calls.pop(callId, None)
+        if call is None:
+            return
+
+        self._finish(call)
+        self.log.debug("Call: %s:%s id: %s expired with %s/%s responses",
+                       call.upiType, call.fname, callId, call.responseNum, call.callNum)
+
+        if self.expiredCallback:
+            self.expiredCallback(call)
@@ -0,0 +1,62 @@
+import logging
+import json
+import time
+from .deadline_timer import monotonic
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+TRACE_LOGGER = "wishful_controller.trace"
+
+
+class CallTracer(object):
+    """Structured trace of a sampled fraction of UPI calls.
+
+    Records are JSON lines on the wishful_controller.trace logger at INFO.
+    A call is sampled by its numeric call id, so its response is recognised
+    without keeping any state per call.
+    """
+    def __init__(self, sampleRate=0.0):
+        self.log = logging.getLogger(TRACE_LOGGER)
+        self.enabled = False
+        self.samplePeriod = 0
+        self.set_sample_rate(sampleRate)
+
+    def set_sample_rate(self, sampleRate):
+        sampleRate = float(sampleRate)
+        if sampleRate <= 0:
+            self.enabled = False
+            self.samplePeriod = 0
+            return
+
+        self.enabled = True
+        self.samplePeriod = max(1, int(round(1.0 / min(sampleRate, 1.0))))
+
+    def is_sampled(self, callId):
+        try:
+            return int(callId) % self.samplePeriod == 0
+        except ValueError:
+            return False
+
+    def _emit(self, event, **fields):
+        fields["event"] = event
+        fields["ts"] = time.time()
+        self.log.info("%s", json.dumps(fields, default=str, sort_keys=True))
+
+    def call_sent(self, callId, upiType, fname, nodes, serializationType, blocking):
+        self._emit("call", call_id=callId, upi_type=upiType, func_name=fname,
+                   nodes=[node.id for node in nodes], serialization=serializationType,
+                   blocking=blocking)
+
+    def response_received(self, cmdDesc, latency):
+        self._emit("response", call_id=cmdDesc.call_id, upi_type=cmdDesc.type,
+                   func_name=cmdDesc.func_name, node=cmdDesc.caller_id,
+                   error=cmdDesc.repeat_number != 0, latency=latency)
+
+    def call_expired(self, call):
+        self._emit("expired", call_id=call.callId, upi_type=call.upiType, func_name=call.fname,
+                   responses=call.responseNum, calls=call.callNum,
+                   latency=monotonic() - call.startTime)
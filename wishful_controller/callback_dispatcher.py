@@ -0,0 +1,102 @@
+import logging
+from gevent.pool import Pool
+from gevent.queue import Queue, Full
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+class CallbackDispatcher(object):
+    """Runs user callbacks on a fixed set of worker greenlets.
+
+    The receive loop only enqueues and must not wait for workers, they may
+    be blocked in UPI calls whose responses only the receive loop reads.
+    A full queue drops the callback at once, or after putTimeout seconds.
+    Node lifecycle (new node, node exit) callbacks are never dropped, they
+    have an unbounded queue of their own, bounded in practice by agent
+    churn, served by as many workers again. prepare is called on the worker before every callback, e.g. to reset
+    greenlet local state left by the previous one.
+    """
+    def __init__(self, workers=10, queueSize=1000, putTimeout=0, prepare=None):
+        self.log = logging.getLogger("{module}.{name}".format(
+            module=self.__class__.__module__, name=self.__class__.__name__))
+
+        self.workers = workers
+        self.queueSize = queueSize
+        self.putTimeout = putTimeout
+        self.prepare = prepare
+        self.droppedNum = 0
+
+        self.queue = Queue(maxsize=self.queueSize)
+        self.lifecycleQueue = Queue()
+        self.pool = None
+
+    def configure(self, workers=None, queueSize=None, putTimeout=None):
+        if self.pool is not None:
+            raise Exception("Callback dispatcher already running, configure it before start")
+
+        if workers:
+            self.workers = int(workers)
+        if queueSize:
+            self.queueSize = int(queueSize)
+            self.queue = Queue(maxsize=self.queueSize)
+        if putTimeout is not None:
+            self.putTimeout = float(putTimeout)
+
+        self.log.debug("Callback workers: {}, queue size: {}, put timeout: {}".format(
+            self.workers, self.queueSize, self.putTimeout))
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def lifecycle_qsize(self):
+        return self.lifecycleQueue.qsize()
+
+    def start(self):
+        if self.pool is not None:
+            return
+
+        self.pool = Pool(2*self.workers)
+        for i in range(self.workers):
+            self.pool.spawn(self._worker, self.queue)
+            self.pool.spawn(self._worker, self.lifecycleQueue)
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.kill()
+            self.pool = None
+
+    def dispatch(self, callback, *args, **kwargs):
+        if self.pool is None:
+            self.start()
+
+        item = (callback, args, kwargs)
+        try:
+            if self.putTimeout:
+                self.queue.put(item, timeout=self.putTimeout)
+            else:
+                self.queue.put_nowait(item)
+        except Full:
+            self.droppedNum = self.droppedNum + 1
+            self.log.warning("Callback queue full, dropped callback: {}".format(callback))
+            return False
+        return True
+
+    def dispatch_lifecycle(self, callback, *args, **kwargs):
+        if self.pool is None:
+            self.start()
+
+        self.lifecycleQueue.put_nowait((callback, args, kwargs))
+        return True
+
+    def _worker(self, queue):
+        while True:
+            callback, args, kwargs = queue.get()
+            try:
+                if self.prepare:
+                    self.prepare()
+                callback(*args, **kwargs)
+            except Exception as e:
+                self.log.exception("Callback {} failed: {}".format(callback, e))
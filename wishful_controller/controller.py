@@ -1,22 +1,31 @@
 import logging
 import time
 import sys
+import os
 import zmq.green as zmq
 import uuid
 import datetime
 import gevent
 from gevent import Greenlet
-from gevent.event import AsyncResult
-from gevent.local import local
 
 import wishful_framework as msgs
 from wishful_framework import upis_builder
 from wishful_framework import rule_manager
 from wishful_framework import generator_manager
 from .transport_channel import TransportChannel
-from .node_manager import NodeManager, Node
+from .node_manager import NodeManager, Node, Group, SUBSCRIBE_ALL, HELLO_MODE_BROADCAST
 from .module_manager import ModuleManager
 from .hierarchical_control_module import HierarchicalControlModule
+from .callback_dispatcher import CallbackDispatcher
+from .call_table import CallTable
+from .deadline_timer import monotonic
+from .call_context import CallContext, pending_call_context
+from .call_result import AsyncResultCollector, UpiCallFuture, PartialResults, wait_all, wait_any, as_completed
+from .metrics import Metrics
+from .call_tracer import CallTracer
+from .hash_ring import HashRing
+from .shard_control import ShardServer
+from .snapshot import ControllerSnapshot
 
 
 __author__ = "Piotr Gawlowicz, Mikolaj Chwalisz"
@@ -25,71 +34,9 @@ __version__ = "0.1.0"
 __email__ = "{gawlowicz, chwalisz}@tkn.tu-berlin.de"
 
 
-class CallIdCallback(object):
-    def __init__(self, cb, callNum):
-        self.cb = cb
-        self.callNum = callNum
-        self.callbackFireNum = 0
-        self.readyToRemove = False
+#delay of confirming HelloMsg round after restoring snapshot
+RESTORE_HELLO_DELAY = 0.5
 
-    def get_callback(self):
-        self.callbackFireNum = self.callbackFireNum + 1
-        if self.callbackFireNum == self.callNum:
-            self.readyToRemove = True
-        return self.cb
-
-    def ready_to_remove(self):
-        return self.readyToRemove
-
-
-class AsyncResultCollector(object):
-    def __init__(self, callNum):
-        self.log = logging.getLogger("{module}.{name}".format(
-            module=self.__class__.__module__, name=self.__class__.__name__))
-        self.callNum = callNum
-        self.results = {}
-        self.ready = False
-        self.exception = None
-        self.asyncResult = AsyncResult()
-
-    def return_response(self):
-        if self.exception:
-            raise self.exception
-
-        if len(list(self.results.values())) > 1:
-            return self.results
-        else:
-            key, value = self.results.popitem()
-            return value       
-
-    def get(self, block=True, timeout=None):
-        if len(list(self.results.values())) == self.callNum:
-            return self.return_response()
-
-        try:
-            self.log.debug("Waiting for result in blocking call")
-            self.asyncResult.get(timeout=timeout)
-        except gevent.timeout.Timeout as e:
-            return None
-        return self.return_response()
-
-    def set_exception(self, node, e):
-        self.exception = e
-        self.results[node] = e
-
-        if len(list(self.results.values())) == self.callNum:
-            self.ready = True
-            self.asyncResult.set()
-
-    def set(self, node, msg):
-        self.results[node] = msg
-
-        if len(list(self.results.values())) == self.callNum:
-            self.ready = True
-            self.asyncResult.set()
-
-
-local_func_call_context = local()
 
 class Controller(Greenlet):
     def __init__(self, dl=None, ul=None):
@@ -106,12 +53,45 @@ class Controller(Greenlet):
         self.callbacks = {}
         self.call_id_gen = 0
 
+        #user callbacks run on bounded worker pool, not in receive loop
+        #workers are long lived, no call context may leak between callbacks
+        self.callbackDispatcher = CallbackDispatcher(prepare=self._clear_call_context)
+
+        #UPI calls waiting for responses
+        self.callTable = CallTable(self._call_expired)
+
+        #handlers of received messages by CmdDesc type,
+        #types without handler are UPI responses
+        self.msgHandlers = {}
+
         self.moduleManager = ModuleManager(self)
         self.nodeManager = NodeManager(self)
+        self.register_msg_handler(msgs.get_msg_type(msgs.NewNodeMsg), self.nodeManager.add_node)
+        self.register_msg_handler(msgs.get_msg_type(msgs.HelloMsg), self.nodeManager.serve_hello_msg)
+        self.register_msg_handler(msgs.get_msg_type(msgs.NodeExitMsg), self.nodeManager.remove_node)
 
         self.transport = TransportChannel(ul, dl)
         self.transport.subscribe_to(self.uuid)
         self.transport.set_recv_callback(self.process_msgs)
+        self.transport.set_recv_batch_callback(self.process_msgs_batch)
+
+        #call latency, codec and queue statistics, disabled by default
+        self.metrics = Metrics()
+        self.transport.set_metrics(self.metrics)
+        self.metrics.register_gauge("callback_queue_depth", self.callbackDispatcher.qsize)
+        self.metrics.register_gauge("callbacks_dropped", lambda: self.callbackDispatcher.droppedNum)
+        self.metrics.register_gauge("lifecycle_queue_depth", self.callbackDispatcher.lifecycle_qsize)
+        self.metrics.register_gauge("calls_in_flight", lambda: len(self.callTable))
+        self.metrics.register_gauge("decode_pending", self._decode_pending_num)
+        self.metrics.register_gauge("nodes", lambda: len(self.nodeManager.nodes))
+
+        #sampled structured trace of UPI calls, off by default
+        self.tracer = CallTracer()
+
+        #shard of this controller in sharded deployment
+        self.shardName = None
+        self.shardRing = None
+        self.shardServer = None
 
         #Hierarchical Control Module
         self.hc = HierarchicalControlModule(self)
@@ -130,103 +110,111 @@ class Controller(Greenlet):
         #Generator manager
         self.generator = generator_manager.GeneratorManager(self)
 
-        #function call context
-        self._scope = None
-        self._iface = None
-        self._exec_time = None
-        self._delay = None
-        self._timeout = None
-        self._blocking = True
-        self._callback = None
+        self.register_msg_handler("wishful_rule", self._serve_rule_msg)
+        self.register_msg_handler("wishful_generator", self._serve_generator_msg)
+
+        #state saved for warm restart
+        self.snapshot = ControllerSnapshot(self)
+        self.snapshotFile = None
+        self.snapshotInterval = None
+        self._snapshotSaver = None
 
-        #fill thread local variable with default values
+        #function call context, fluent setters derive new contexts from it
+        self._defaultCallContext = CallContext(self)
         self._clear_call_context()
-        
-        #container for blocking calls
-        self._asyncResults = {}
 
     def stop(self):
         self.running = False
         self.log.debug("Nofity EXIT to all modules")
         self.moduleManager.exit()
+        if self._snapshotSaver:
+            self._snapshotSaver.kill()
+            self._snapshotSaver = None
+        if self.snapshotFile:
+            self.save_snapshot()
+        self.nodeManager.stop()
+        self.callTable.stop()
+        self.callbackDispatcher.stop()
+        if self.shardServer:
+            self.shardServer.stop()
         self.transport.stop()
         self.kill()
 
     def _run(self):
-        #fill thread local variable with default values
+        #no pending call context in receive loop
         self._clear_call_context()
 
         self.log.debug("Controller starts".format())
         self.log.debug("Nofity START to all modules")
         self.moduleManager.start()
+        self.callbackDispatcher.start()
+        #modules are loaded, register their protobuf messages before receiving
+        self.transport.register_loaded_pb_modules()
         self.transport.start()
+        if self.shardServer:
+            self.shardServer.start()
+
+        if self.snapshotFile and os.path.exists(self.snapshotFile):
+            try:
+                self.load_snapshot()
+            except Exception as e:
+                self.log.error("Cannot restore snapshot: {}: {}".format(self.snapshotFile, e))
+
+        if self.snapshotFile and self.snapshotInterval:
+            self._snapshotSaver = gevent.spawn(self._save_snapshot_periodically)
 
         self.running = True
         while self.running:
             self.transport.start_receiving()
 
+    def get_call_context(self):
+        ctx = pending_call_context.ctx
+        if ctx is None or ctx.controller is not self:
+            return self._defaultCallContext
+        return ctx
+
     def group(self, group):
-        self._scope = group
-        local_func_call_context._scope = group
-        return self
+        return self.get_call_context().group(group)
 
     def node(self, node):
-        self._scope = node
-        local_func_call_context._scope = node
-        return self        
+        return self.get_call_context().node(node)
 
     def nodes(self, nodelist):
-        self._scope = nodelist
-        local_func_call_context._scope = nodelist
-        return self
+        return self.get_call_context().nodes(nodelist)
 
     def iface(self, iface):
-        self._iface = iface
-        local_func_call_context._iface = iface
-        return self
+        return self.get_call_context().iface(iface)
 
     def exec_time(self, exec_time):
-        self._exec_time = exec_time
-        local_func_call_context._exec_time = exec_time
-        return self
+        return self.get_call_context().exec_time(exec_time)
 
     def delay(self, delay):
-        self._delay = delay
-        local_func_call_context._delay = delay
-        return self
+        return self.get_call_context().delay(delay)
 
     def timeout(self, value):
-        self._timeout = value
-        local_func_call_context._timeout = value
-        return self
+        return self.get_call_context().timeout(value)
 
     def blocking(self, value=True):
-        self._blocking = value
-        local_func_call_context._blocking = value
-        return self
+        return self.get_call_context().blocking(value)
 
     def callback(self, callback):
-        self._callback = callback
-        local_func_call_context._callback = callback
-        return self
+        return self.get_call_context().callback(callback)
+
+    def timeout_callback(self, callback):
+        return self.get_call_context().timeout_callback(callback)
+
+    def future(self, value=True):
+        return self.get_call_context().future(value)
+
+    def quorum(self, value):
+        return self.get_call_context().quorum(value)
+
+    def partial_results(self, value=True):
+        return self.get_call_context().partial_results(value)
 
 
     def _clear_call_context(self):
-        self._scope = None
-        self._iface = None
-        self._exec_time = None
-        self._delay = None
-        self._timeout = None
-        self._blocking = True
-        self._callback = None
-
-        local_func_call_context._scope = None
-        local_func_call_context._iface = None
-        local_func_call_context._exec_time = None
-        local_func_call_context._delay = None
-        local_func_call_context._timeout = None
-        local_func_call_context._blocking = True
-        local_func_call_context._callback = None
+        pending_call_context.ctx = None
 
 
     def fire_callback(self, callback, *args, **kwargs):
@@ -234,6 +222,88 @@ class Controller(Greenlet):
         callback(*args, **kwargs)
 
 
+    def _decode_pending_num(self):
+        offloader = self.transport.decodeOffloader
+        return offloader.pending_num() if offloader else 0
+
+
+    def get_metrics(self):
+        return self.metrics.snapshot()
+
+
+    def _call_expired(self, call):
+        if self.metrics.enabled:
+            self.metrics.call_timeout(call.upiType, call.fname)
+
+        if self.tracer.enabled and self.tracer.is_sampled(call.callId):
+            self.tracer.call_expired(call)
+
+        if call.collector:
+            call.collector.expire()
+
+        if call.timeoutCallback:
+            self.callbackDispatcher.dispatch(self.fire_callback, call.timeoutCallback, "all",
+                                             call.get_results(), call.missing_nodes())
+
+
+    def set_shard(self, shardName, shards, replicas=100, control=None):
+        """Manage only agents mapped to shardName by consistent hashing.
+
+        Every shard controller of a deployment has to use the same shards
+        list; agents reach all shards through a ShardForwarder. With control
+        endpoint the shard serves a ShardedController front.
+        """
+        if shardName not in shards:
+            raise Exception("Shard: {} not in shards: {}".format(shardName, shards))
+
+        if self.nodeManager.subscriptionMode == SUBSCRIBE_ALL:
+            raise Exception("Subscription mode: {} would receive traffic of all shards".format(SUBSCRIBE_ALL))
+
+        if self.nodeManager.helloMode == HELLO_MODE_BROADCAST:
+            raise Exception("Hello mode: {} would reach agents of all shards".format(HELLO_MODE_BROADCAST))
+
+        self.shardName = shardName
+        self.shardRing = HashRing(shards, replicas)
+        self.nodeManager.set_node_filter(self.owns_agent)
+        if control:
+            self.shardServer = ShardServer(self, control)
+
+
+    def owns_agent(self, agentId):
+        if self.shardRing is None:
+            return True
+        return self.shardRing.get_shard(agentId) == self.shardName
+
+
+    def save_snapshot(self, path=None):
+        path = path or self.snapshotFile
+        try:
+            self.snapshot.save(path)
+        except Exception as e:
+            self.log.error("Cannot save snapshot: {}: {}".format(path, e))
+
+
+    def load_snapshot(self, path=None):
+        """Rehydrate nodes, groups and local programs saved by previous run.
+
+        Restored nodes are routable at once; one HelloMsg round confirms
+        them, nodes that stay silent expire after helloTimeout as usual.
+        """
+        state = self.snapshot.load(path or self.snapshotFile)
+        #agents reconnect to restarted sockets before they can receive
+        if self.shardRing is not None:
+            gevent.spawn_later(RESTORE_HELLO_DELAY, self.nodeManager.send_hello_to_nodes)
+        else:
+            gevent.spawn_later(RESTORE_HELLO_DELAY, self.nodeManager.send_hello_broadcast)
+        return state
+
+
+    def _save_snapshot_periodically(self):
+        while True:
+            gevent.sleep(self.snapshotInterval)
+            self.save_snapshot()
+
+
     def set_controller_info(self, name=None, info=None):
         self.name = name
         self.info = info
@@ -271,6 +341,51 @@ class Controller(Greenlet):
             if "uplink" in controllerInfo:
                 self.transport.set_uplink(controllerInfo["uplink"])
 
+            if "callback_workers" in controllerInfo or "callback_queue_size" in controllerInfo \
+                    or "callback_queue_full" in controllerInfo or "callback_queue_timeout" in controllerInfo:
+                #"drop" or "block", the latter waits at most callback_queue_timeout
+                putTimeout = 0
+                if controllerInfo.get("callback_queue_full", "drop") == "block":
+                    putTimeout = controllerInfo.get("callback_queue_timeout", 1.0)
+                self.callbackDispatcher.configure(controllerInfo.get("callback_workers", None),
+                                                  controllerInfo.get("callback_queue_size", None),
+                                                  putTimeout)
+
+            if "offload_threshold" in controllerInfo:
+                self.transport.set_decode_offloading(controllerInfo["offload_threshold"],
+                                                     controllerInfo.get("offload_workers", 4))
+
+            if "metrics" in controllerInfo:
+                self.metrics.enable(bool(controllerInfo["metrics"]))
+
+            #shard first, hello and subscription modes are checked against it
+            if "shard" in controllerInfo:
+                shardInfo = controllerInfo["shard"]
+                self.set_shard(shardInfo["name"], shardInfo["shards"], shardInfo.get("replicas", 100),
+                               shardInfo.get("control", None))
+
+            if "hello_mode" in controllerInfo or "hello_interval" in controllerInfo:
+                self.nodeManager.set_hello_mode(controllerInfo.get("hello_mode", self.nodeManager.helloMode),
+                                                controllerInfo.get("hello_interval", None))
+
+            if "snapshot_file" in controllerInfo:
+                self.snapshotFile = controllerInfo["snapshot_file"]
+                self.snapshotInterval = controllerInfo.get("snapshot_interval", None)
+
+            if "subscription_mode" in controllerInfo:
+                self.nodeManager.set_subscription_mode(controllerInfo["subscription_mode"])
+
+            if "join_window" in controllerInfo:
+                self.nodeManager.set_join_window(controllerInfo["join_window"],
+                                                 controllerInfo.get("join_batch_size", None))
+
+            if "trace_sample_rate" in controllerInfo:
+                self.tracer.set_sample_rate(controllerInfo["trace_sample_rate"])
+
+            if "recv_batch_size" in controllerInfo or "recv_drain_limit" in controllerInfo:
+                self.transport.set_recv_batching(controllerInfo.get("recv_batch_size", None),
+                                                 controllerInfo.get("recv_drain_limit", None))
+
         #load modules
         if 'modules' in config:
             moduleDesc = config['modules']
@@ -300,6 +415,22 @@ class Controller(Greenlet):
         return decorator
 
 
+    def register_msg_handler(self, msgType, handler, replace=False):
+        """Serve received messages of msgType with handler(msgContainer).
+
+        Used by modules to handle their own message types, msgContainer is
+        [topic, cmdDesc, msg] with payload already deserialized.
+        """
+        if msgType in self.msgHandlers and not replace:
+            raise Exception("Handler for message type: {} already registered".format(msgType))
+        self.log.debug("Register handler for message type: %s", msgType)
+        self.msgHandlers[msgType] = handler
+
+
+    def unregister_msg_handler(self, msgType):
+        return self.msgHandlers.pop(msgType, None)
+
+
     def add_callback(self, function, **options):
         def decorator(callback):
             self.log.debug("Register callback for: {}".format(function.__name__))
@@ -321,14 +452,8 @@ class Controller(Greenlet):
         return self.call_id_gen
 
 
-    def send_cmd_to_node(self, destNode, callId, msgContainer):
-        #translate to node if needed
-        if not isinstance(destNode, Node):
-            destNode = self.nodeManager.get_node_by_str(destNode)
-
-
+    def _check_upi_supported(self, destNode, cmdDesc):
         #check if function is supported by agent, if not raise exception
-        cmdDesc = msgContainer[0]
         upi_type = cmdDesc.type
         fname = cmdDesc.func_name
         iface = cmdDesc.interface
@@ -341,24 +466,65 @@ class Controller(Greenlet):
                 for iface: {}, please install proper modules".format(destNode.name, upi_type, fname, iface))
 
 
+    def send_cmd_to_node(self, destNode, callId, msgContainer):
+        #translate to node if needed
+        if not isinstance(destNode, Node):
+            destNode = self.nodeManager.get_node_by_str(destNode)
+
+        self._check_upi_supported(destNode, msgContainer[0])
+
         #set destination
         myMsgContainter = [destNode.id]
         myMsgContainter.extend(msgContainer)
-        self.log.debug("Controller sends cmd message to node: {}".format(destNode.id))
+        self.log.debug("Controller sends cmd message to node: %s", destNode.id)
         self.transport.send_downlink_msg(myMsgContainter)
+        return [destNode]
+
+
+    def send_cmd_to_nodes(self, destNodes, callId, msgContainer):
+        nodes = []
+        for destNode in destNodes:
+            if not isinstance(destNode, Node):
+                destNode = self.nodeManager.get_node_by_str(destNode)
+            self._check_upi_supported(destNode, msgContainer[0])
+            nodes.append(destNode)
+
+        self.log.debug("Controller sends cmd message to %s nodes", len(nodes))
+        self.transport.send_downlink_msg_batch([n.id for n in nodes], msgContainer)
+        return nodes
+
+
+    def send_cmd_to_group(self, group, callId, msgContainer):
+        cmdDesc = msgContainer[0]
+        if not group.nodes:
+            raise Exception("Group: {} has no nodes for UPI function: {}:{}".format(group.name, cmdDesc.type, cmdDesc.func_name))
+
+        #a single publish on a group topic would need agents to confirm their
+        #subscription to it, and the agent protocol has no such step (a
+        #HelloMsg on uplink does not order with SUBSCRIBE on downlink), so
+        #members get the message serialized once and sent on their topics
+        self.log.debug("Controller sends cmd message to group: %s", group.name)
+        return self.send_cmd_to_nodes(group.nodes, callId, msgContainer)
 
 
     def exec_cmd(self, upi_type, fname, *args, **kwargs):
-        self.log.debug("Controller builds cmd message: {}.{} with args:{}, kwargs:{}".format(upi_type, fname, args, kwargs))
+        #repr of kwargs can be large, build it only when debugging
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug("Controller builds cmd message: %s.%s with args:%s, kwargs:%s", upi_type, fname, args, kwargs)
         
         #get function call context
-        scope = local_func_call_context._scope
-        iface = local_func_call_context._iface
-        exec_time = local_func_call_context._exec_time
-        delay = local_func_call_context._delay
-        timeout = local_func_call_context._timeout
-        blocking = local_func_call_context._blocking
-        callback = local_func_call_context._callback
+        ctx = self.get_call_context()
+        scope = ctx._scope
+        iface = ctx._iface
+        exec_time = ctx._exec_time
+        delay = ctx._delay
+        timeout = ctx._timeout
+        blocking = ctx._blocking
+        callback = ctx._callback
+        timeoutCallback = ctx._timeout_callback
+        future = ctx._future
+        quorum = ctx._quorum
+        partial = ctx._partial_results
 
         self._clear_call_context()
 
@@ -387,98 +553,159 @@ class Controller(Greenlet):
             raise Exception("Scheduling function: {}:{} call in past".format(upi_type,fname))
 
         #count nodes if list passed
-        if hasattr(scope, '__iter__') and not isinstance(scope, str):
+        if isinstance(scope, Group):
+            nodeNum = len(scope.nodes)
+        elif hasattr(scope, '__iter__') and not isinstance(scope, str):
             nodeNum = len(scope)
         else:
             nodeNum = 1
 
         #set callback for this function call 
-        if callback:
-            self.callbacks[callId] = CallIdCallback(callback, nodeNum)
+        if callback or timeoutCallback or future:
             blocking = False
 
-        #if blocking call, wait for response
-        if blocking:
-            asyncResultCollector = AsyncResultCollector(nodeNum)
-            self._asyncResults[callId] = asyncResultCollector
-
-        #Serialize kwargs (they contrain args)
-        cmdDesc.serialization_type = msgs.CmdDesc.PICKLE
+        #if blocking call, wait for response; future collects without waiting
+        asyncResultCollector = None
+        if future:
+            asyncResultCollector = UpiCallFuture(nodeNum, quorum, partial)
+        elif blocking:
+            asyncResultCollector = AsyncResultCollector(nodeNum, quorum, partial)
+
+        #register before sending, response may come before send returns
+        call = None
+        if callback or timeoutCallback or asyncResultCollector:
+            call = self.callTable.add(callId, upi_type, fname, nodeNum, timeout, callback,
+                                      timeoutCallback, asyncResultCollector, expire=not blocking)
+
+        #Serialize kwargs (they contrain args) with cheapest codec able to encode them
+        cmdDesc.serialization_type = self.transport.select_serialization_type(kwargs)
         msgContainer = [cmdDesc, kwargs]
         
 
-        #TODO: currently sending cmd msg to each node separately;
-        #it would be more efficient to exploit PUB/SUB zmq mechanism
-        #create group with uuid and tell nodes to subscribe to this uuid
-        #then send msg to group
-        if hasattr(scope, '__iter__') and not isinstance(scope, str):
-            for node in scope:
-                self.send_cmd_to_node(node, callId, msgContainer)
-        else:
-            node = scope
-            self.send_cmd_to_node(node, callId, msgContainer)
+        #groups and node lists get one frame serialized for all nodes
+        try:
+            if isinstance(scope, Group):
+                nodes = self.send_cmd_to_group(scope, callId, msgContainer)
+            elif hasattr(scope, '__iter__') and not isinstance(scope, str):
+                nodes = self.send_cmd_to_nodes(scope, callId, msgContainer)
+            else:
+                node = scope
+                nodes = self.send_cmd_to_node(node, callId, msgContainer)
+        except Exception:
+            if call:
+                self.callTable.remove(callId)
+            raise
+
+        if call:
+            call.nodes = nodes
+        if asyncResultCollector:
+            asyncResultCollector.set_nodes(nodes)
+
+        if self.metrics.enabled:
+            self.metrics.call_sent(upi_type, fname, len(nodes))
+
+        if self.tracer.enabled and self.tracer.is_sampled(callId):
+            self.tracer.call_sent(callId, upi_type, fname, nodes, cmdDesc.serialization_type, blocking)
 
 
         #if blocking call, wait for response
         if blocking:
-            response = asyncResultCollector.get(timeout=timeout)
-            del self._asyncResults[callId]
+            try:
+                response = asyncResultCollector.get(timeout=timeout)
+            finally:
+                self.callTable.remove(callId)
+                if not asyncResultCollector.ready:
+                    if self.metrics.enabled:
+                        self.metrics.call_timeout(upi_type, fname)
+                    if self.tracer.enabled and self.tracer.is_sampled(callId):
+                        self.tracer.call_expired(call)
             return response
 
+        if future:
+            return asyncResultCollector
+
         return None
 
 
+    def process_msgs_batch(self, batch):
+        for msgContainer in batch:
+            self.process_msgs(msgContainer)
+
+
     def process_msgs(self, msgContainer):
-        dest = msgContainer[0]
         cmdDesc = msgContainer[1]
-        msg = msgContainer[2]
 
-        self.log.debug("Controller received message: {} from agent".format(cmdDesc.type))
+        self.log.debug("Controller received message: %s:%s from agent", cmdDesc.type, cmdDesc.func_name)
+
+        if self.metrics.enabled:
+            self.metrics.msg_received(cmdDesc.type)
+
+        handler = self.msgHandlers.get(cmdDesc.type, None)
+        if handler:
+            handler(msgContainer)
+        else:
+            self.serve_upi_response(msgContainer)
+
+
+    def _serve_rule_msg(self, msgContainer):
+        cmdDesc = msgContainer[1]
+        self.rule._receive("all", self.nodeManager.get_node_by_id(cmdDesc.caller_id), msgContainer[2])
 
-        if cmdDesc.type == msgs.get_msg_type(msgs.NewNodeMsg):
-            self.nodeManager.add_node(msgContainer)
 
-        elif cmdDesc.type == msgs.get_msg_type(msgs.HelloMsg):
-            self.nodeManager.serve_hello_msg(msgContainer)
+    def _serve_generator_msg(self, msgContainer):
+        cmdDesc = msgContainer[1]
+        self.generator._receive("all", self.nodeManager.get_node_by_id(cmdDesc.caller_id), msgContainer[2])
 
-        elif cmdDesc.type == msgs.get_msg_type(msgs.NodeExitMsg):
-            self.nodeManager.remove_node(msgContainer)
 
-        elif cmdDesc.type == "hierarchical_control":
-            self.hc.receive_from_local_ctr_program(msg)
+    def serve_upi_response(self, msgContainer):
+        cmdDesc = msgContainer[1]
+        msg = msgContainer[2]
 
-        elif cmdDesc.type == "wishful_rule":
-            self.rule._receive("all", self.nodeManager.get_node_by_id(cmdDesc.caller_id), msg)
+        callId = cmdDesc.call_id
+        call = self.callTable.get(callId)
+        node = self.nodeManager.get_node_by_id(cmdDesc.caller_id)
 
-        elif cmdDesc.type == "wishful_generator":
-            self.generator._receive("all", self.nodeManager.get_node_by_id(cmdDesc.caller_id), msg)
+        if self.metrics.enabled:
+            latency = monotonic() - call.startTime if call else None
+            self.metrics.call_response(cmdDesc.type, cmdDesc.func_name, latency, cmdDesc.repeat_number != 0)
 
-        else:
-            self.log.debug("Controller received message: {}:{} from agent".format(cmdDesc.type, cmdDesc.func_name))
+        if self.tracer.enabled and self.tracer.is_sampled(callId):
+            self.tracer.response_received(cmdDesc, monotonic() - call.startTime if call else None)
 
-            callId = cmdDesc.call_id
-            if callId in self._asyncResults:
-                #TODO: define new protobuf message for return values; currently using repeat_number in CmdDesc 
-                #0-executed correctly, 1-exception
-                if cmdDesc.repeat_number == 0:
-                    self._asyncResults[callId].set(self.nodeManager.get_node_by_id(cmdDesc.caller_id), msg)
-                else:
-                    self._asyncResults[callId].set_exception(self.nodeManager.get_node_by_id(cmdDesc.caller_id), msg)
+        if call is None and self.callTable.is_finished(callId):
+            #quorum reached, expired or timed out before this node answered
+            self.log.debug("Late response to: %s:%s id: %s dropped", cmdDesc.type, cmdDesc.func_name, callId)
+            return
 
+        if call and call.collector:
+            #TODO: define new protobuf message for return values; currently using repeat_number in CmdDesc 
+            #0-executed correctly, 1-exception
+            if cmdDesc.repeat_number == 0:
+                accepted = call.collector.set(node, msg)
             else:
-                if cmdDesc.call_id in self.callbacks:
-                    callbackObj = self.callbacks[cmdDesc.call_id]
-                    callback = callbackObj.get_callback()
-                    gevent.spawn(self.fire_callback, callback, "all", self.nodeManager.get_node_by_id(cmdDesc.caller_id), msg)
-                    if callbackObj.ready_to_remove():
-                        del self.callbacks[cmdDesc.call_id]
-
-                elif cmdDesc.func_name in self.callbacks:
-                    callback = self.callbacks[cmdDesc.func_name]
-                    gevent.spawn(self.fire_callback, callback, "all", self.nodeManager.get_node_by_id(cmdDesc.caller_id), msg)
-
-                elif self.default_callback:
-                    gevent.spawn(self.fire_callback, self.default_callback, "all", self.nodeManager.get_node_by_id(cmdDesc.caller_id), cmdDesc.func_name, msg)
-
-                else:
-                    self.log.debug("Response to: {}:{} not served".format(cmdDesc.type, cmdDesc.func_name))
+                accepted = call.collector.set_exception(node, msg)
+
+            if accepted:
+                call.responseNum = call.responseNum + 1
+            if call.collector.ready:
+                self.callTable.remove(callId)
+            return
+
+        callback = None
+        if call:
+            #call with only timeout callback falls through to function callbacks
+            self.callTable.response_received(call, node, msg)
+            callback = call.callback
+
+        if callback:
+            self.callbackDispatcher.dispatch(self.fire_callback, callback, "all", node, msg)
+
+        elif cmdDesc.func_name in self.callbacks:
+            callback = self.callbacks[cmdDesc.func_name]
+            self.callbackDispatcher.dispatch(self.fire_callback, callback, "all", node, msg)
+
+        elif self.default_callback:
+            self.callbackDispatcher.dispatch(self.fire_callback, self.default_callback, "all", node, cmdDesc.func_name, msg)
+
+        else:
+            self.log.debug("Response to: %s:%s not served", cmdDesc.type, cmdDesc.func_name)
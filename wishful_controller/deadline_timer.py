@@ -0,0 +1,112 @@
+import logging
+import time
+import heapq
+import itertools
+import gevent
+from gevent.event import Event
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+#deadlines must not move with wall clock steps (e.g. NTP), python 2 lacks
+#time.monotonic and falls back to wall clock
+monotonic = getattr(time, "monotonic", time.time)
+
+
+class DeadlineTimer(object):
+    """Fires callback(key) for every key whose deadline has passed.
+
+    All keys share one heap and one greenlet. Moving a deadline later only
+    updates a dict entry; the stale heap entry is re-pushed when it comes
+    due, so the heap never holds more than one live entry per key. Entries
+    of cancelled keys are dropped once they outnumber live keys.
+    Deadlines come from the monotonic clock.
+    """
+    #heap entries tolerated beyond two per live key before compaction
+    COMPACT_SLACK = 64
+
+    def __init__(self, callback, name="DeadlineTimer"):
+        self.log = logging.getLogger("{module}.{name}".format(
+            module=self.__class__.__module__, name=name))
+        self.callback = callback
+
+        self._deadlines = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = Event()
+        self._greenlet = None
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def get_deadline(self, key):
+        return self._deadlines.get(key, None)
+
+    def schedule(self, key, timeout):
+        deadline = monotonic() + timeout
+        oldDeadline = self._deadlines.get(key, None)
+        self._deadlines[key] = deadline
+
+        if oldDeadline is not None and deadline >= oldDeadline:
+            return
+
+        heapq.heappush(self._heap, (deadline, next(self._seq), key))
+        self._wakeup.set()
+
+        if self._greenlet is None:
+            self.start()
+
+    def cancel(self, key):
+        if self._deadlines.pop(key, None) is not None:
+            if len(self._heap) > 2 * len(self._deadlines) + self.COMPACT_SLACK:
+                self._compact()
+
+    def _compact(self):
+        #one entry per live key, at its current deadline
+        self._heap = [(deadline, next(self._seq), key) for key, deadline in self._deadlines.items()]
+        heapq.heapify(self._heap)
+
+    def start(self):
+        if self._greenlet is None:
+            self._greenlet = gevent.spawn(self._run)
+
+    def stop(self):
+        if self._greenlet is not None:
+            self._greenlet.kill()
+            self._greenlet = None
+
+    def _run(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                self._wakeup.wait()
+                continue
+
+            deadline, seq, key = self._heap[0]
+            now = monotonic()
+            if deadline > now:
+                self._wakeup.clear()
+                self._wakeup.wait(deadline - now)
+                continue
+
+            heapq.heappop(self._heap)
+            currentDeadline = self._deadlines.get(key, None)
+            if currentDeadline is None:
+                #cancelled
+                continue
+
+            if currentDeadline > deadline:
+                heapq.heappush(self._heap, (currentDeadline, seq, key))
+                continue
+
+            del self._deadlines[key]
+            try:
+                self.callback(key)
+            except Exception as e:
+                self.log.exception("Timer callback for {} failed: {}".format(key, e))
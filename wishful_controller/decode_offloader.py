@@ -0,0 +1,98 @@
+import logging
+from collections import deque
+import gevent
+from gevent.threadpool import ThreadPool
+from .serializers import decode_payload
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+class DecodeOffloader(object):
+    """Decodes large payloads off the hub thread, keeping order per agent.
+
+    Payloads above threshold go to a thread pool. A process pool would not
+    help: the decoded object has to be pickled back to this process, which
+    for pickle and msgpack costs as much as decoding it here. While an agent has a payload in
+    flight, its later messages, including NodeExitMsg sent on shared topic,
+    are queued behind it and handed to deliver in arrival order.
+    """
+    def __init__(self, deliver, threshold=1024*1024, workers=4):
+        self.log = logging.getLogger("{module}.{name}".format(
+            module=self.__class__.__module__, name=self.__class__.__name__))
+
+        self.deliver = deliver
+        self.threshold = threshold
+        self.workers = workers
+
+        self._threadPool = None
+        self._pending = {}
+        self._flushing = set()
+
+    def pending_num(self):
+        return sum(len(q) for q in self._pending.values())
+
+    def has_pending(self, agentId=None):
+        if agentId is None:
+            return bool(self._pending)
+        return agentId in self._pending
+
+    def should_offload(self, size):
+        return size >= self.threshold
+
+    def _get_thread_pool(self):
+        if self._threadPool is None:
+            self._threadPool = ThreadPool(self.workers)
+        return self._threadPool
+
+    def stop(self):
+        if self._threadPool is not None:
+            self._threadPool.kill()
+            self._threadPool = None
+
+    def _decode(self, serializer, payload, buffers, cmdDesc):
+        return self._get_thread_pool().spawn(decode_payload, serializer, payload, buffers, cmdDesc).get()
+
+    def submit(self, agentId, dest, cmdDesc, serializer, payload, buffers, offload):
+        #entry: [done, msgContainer]
+        entry = [False, None]
+        self._pending.setdefault(agentId, deque()).append(entry)
+
+        if offload:
+            gevent.spawn(self._decode_entry, agentId, entry, dest, cmdDesc, serializer, payload, buffers)
+            return
+
+        #small msg queued behind offloaded one of the same agent
+        msg = decode_payload(serializer, payload, buffers, cmdDesc) if serializer else bytes(payload)
+        entry[1] = [dest, cmdDesc, msg]
+        entry[0] = True
+        self._flush(agentId)
+
+    def _decode_entry(self, agentId, entry, dest, cmdDesc, serializer, payload, buffers):
+        try:
+            msg = self._decode(serializer, payload, buffers, cmdDesc)
+            entry[1] = [dest, cmdDesc, msg]
+        except Exception as e:
+            self.log.error("Decoding msg: {}:{} from {} failed: {}".format(cmdDesc.type, cmdDesc.func_name, dest, e))
+        entry[0] = True
+        self._flush(agentId)
+
+    def _flush(self, agentId):
+        #deliver may yield, only one greenlet flushes an agent at a time
+        if agentId in self._flushing:
+            return
+
+        self._flushing.add(agentId)
+        try:
+            queue = self._pending.get(agentId, None)
+            while queue and queue[0][0]:
+                done, msgContainer = queue.popleft()
+                if msgContainer is not None:
+                    self.deliver([msgContainer])
+
+            if queue is not None and not queue:
+                del self._pending[agentId]
+        finally:
+            self._flushing.discard(agentId)
@@ -0,0 +1,47 @@
+import hashlib
+from bisect import bisect
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+class HashRing(object):
+    """Consistent hashing of agent uuids onto shard names.
+
+    Every shard owns replicas points on the ring, so adding or removing a
+    shard only moves the agents of neighbouring points.
+    """
+    def __init__(self, shards=(), replicas=100):
+        self.replicas = replicas
+        self._points = []
+        self._owners = {}
+        for shard in shards:
+            self.add_shard(shard)
+
+    @staticmethod
+    def _hash(key):
+        return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+    @property
+    def shards(self):
+        return sorted(set(self._owners.values()))
+
+    def add_shard(self, shard):
+        for i in range(self.replicas):
+            point = self._hash("{}#{}".format(shard, i))
+            if point not in self._owners:
+                self._owners[point] = shard
+        self._points = sorted(self._owners.keys())
+
+    def remove_shard(self, shard):
+        for point in [p for p, s in self._owners.items() if s == shard]:
+            del self._owners[point]
+        self._points = sorted(self._owners.keys())
+
+    def get_shard(self, key):
+        if not self._points:
+            raise Exception("No shard in hash ring")
+        index = bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[self._points[index]]
@@ -47,6 +47,11 @@ class HierarchicalControlModule(wishful_module.ControllerModule):
         self.log = logging.getLogger('HierarchicalControlModule')
 
         self.local_progs_by_node = {}
+        controller.register_msg_handler("hierarchical_control", self._serve_msg)
+
+
+    def _serve_msg(self, msgContainer):
+        self.receive_from_local_ctr_program(msgContainer[2])
 
 
     def receive_from_local_ctr_program(self, msg):
@@ -91,7 +96,7 @@ class HierarchicalControlModule(wishful_module.ControllerModule):
         funcCode = ''.join(funcCode)
         funcName = program.__name__
 
-        destNode = self.controller._scope
+        destNode = self.controller.get_call_context().scope
         destNode = self.controller.nodeManager.get_node_by_str(destNode)
         destNodeUuid = destNode.id
 
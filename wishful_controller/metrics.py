@@ -0,0 +1,169 @@
+from bisect import bisect_left
+from .deadline_timer import monotonic
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(object):
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum = self.sum + value
+        self.count = self.count + 1
+
+    def snapshot(self):
+        cumulative = 0
+        buckets = []
+        for bound, num in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative = cumulative + num
+            buckets.append((bound, cumulative))
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
+
+
+class CallStats(object):
+    __slots__ = ("calls", "responses", "errors", "timeouts", "latency")
+
+    def __init__(self):
+        self.calls = 0
+        self.responses = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.latency = Histogram()
+
+    def snapshot(self):
+        return {"calls": self.calls,
+                "responses": self.responses,
+                "errors": self.errors,
+                "error_rate": float(self.errors) / self.responses if self.responses else 0.0,
+                "timeouts": self.timeouts,
+                "latency": self.latency.snapshot()}
+
+
+class CodecStats(object):
+    __slots__ = ("bytes", "time")
+
+    def __init__(self):
+        self.bytes = 0
+        self.time = Histogram()
+
+    def snapshot(self):
+        return {"bytes": self.bytes, "time": self.time.snapshot()}
+
+
+class Metrics(object):
+    """Controller call, codec and queue statistics.
+
+    Disabled by default; hot paths only test the enabled flag. Gauges are
+    callables evaluated when a snapshot is taken.
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.startTime = monotonic()
+        self.gauges = {}
+        self.reset()
+
+    def reset(self):
+        self.calls = {}
+        self.msgs = {}
+        self.serialize = CodecStats()
+        self.deserialize = CodecStats()
+
+    def enable(self, value=True):
+        self.enabled = value
+
+    def register_gauge(self, name, fn):
+        self.gauges[name] = fn
+
+    def _call_stats(self, upiType, fname):
+        key = (upiType, fname)
+        stats = self.calls.get(key, None)
+        if stats is None:
+            stats = self.calls[key] = CallStats()
+        return stats
+
+    def call_sent(self, upiType, fname, nodeNum=1):
+        self._call_stats(upiType, fname).calls += nodeNum
+
+    def call_response(self, upiType, fname, latency=None, error=False):
+        stats = self._call_stats(upiType, fname)
+        stats.responses += 1
+        if error:
+            stats.errors += 1
+        if latency is not None:
+            stats.latency.observe(latency)
+
+    def call_timeout(self, upiType, fname):
+        self._call_stats(upiType, fname).timeouts += 1
+
+    def msg_received(self, msgType):
+        self.msgs[msgType] = self.msgs.get(msgType, 0) + 1
+
+    def serialized(self, duration, size):
+        self.serialize.bytes += size
+        self.serialize.time.observe(duration)
+
+    def deserialized(self, duration, size):
+        self.deserialize.bytes += size
+        self.deserialize.time.observe(duration)
+
+    def snapshot(self):
+        return {"uptime": monotonic() - self.startTime,
+                "calls": dict(("{}.{}".format(k[0], k[1]), v.snapshot()) for k, v in self.calls.items()),
+                "msgs": dict(self.msgs),
+                "serialize": self.serialize.snapshot(),
+                "deserialize": self.deserialize.snapshot(),
+                "gauges": dict((name, fn()) for name, fn in self.gauges.items())}
+
+    def _histogram_text(self, lines, name, labels, hist):
+        sep = "," if labels else ""
+        for bound, cumulative in hist.snapshot()["buckets"]:
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append('{}_bucket{{{}{}le="{}"}} {}'.format(name, labels, sep, le, cumulative))
+        labels = "{{{}}}".format(labels) if labels else ""
+        lines.append("{}_sum{} {}".format(name, labels, hist.sum))
+        lines.append("{}_count{} {}".format(name, labels, hist.count))
+
+    def prometheus_text(self):
+        lines = []
+        lines.append("# TYPE wishful_upi_calls_total counter")
+        lines.append("# TYPE wishful_upi_responses_total counter")
+        lines.append("# TYPE wishful_upi_errors_total counter")
+        lines.append("# TYPE wishful_upi_timeouts_total counter")
+        lines.append("# TYPE wishful_upi_latency_seconds histogram")
+        for (upiType, fname), stats in self.calls.items():
+            labels = 'upi_type="{}",func_name="{}"'.format(upiType, fname)
+            lines.append("wishful_upi_calls_total{{{}}} {}".format(labels, stats.calls))
+            lines.append("wishful_upi_responses_total{{{}}} {}".format(labels, stats.responses))
+            lines.append("wishful_upi_errors_total{{{}}} {}".format(labels, stats.errors))
+            lines.append("wishful_upi_timeouts_total{{{}}} {}".format(labels, stats.timeouts))
+            self._histogram_text(lines, "wishful_upi_latency_seconds", labels, stats.latency)
+
+        lines.append("# TYPE wishful_msgs_received_total counter")
+        for msgType, num in self.msgs.items():
+            lines.append('wishful_msgs_received_total{{type="{}"}} {}'.format(msgType, num))
+
+        for direction, stats in (("serialize", self.serialize), ("deserialize", self.deserialize)):
+            lines.append("# TYPE wishful_{}_bytes_total counter".format(direction))
+            lines.append("wishful_{}_bytes_total {}".format(direction, stats.bytes))
+            lines.append("# TYPE wishful_{}_seconds histogram".format(direction))
+            self._histogram_text(lines, "wishful_{}_seconds".format(direction), "", stats.time)
+
+        for name, fn in self.gauges.items():
+            lines.append("# TYPE wishful_{} gauge".format(name))
+            lines.append("wishful_{} {}".format(name, fn()))
+
+        return "\n".join(lines) + "\n"
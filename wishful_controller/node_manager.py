@@ -1,8 +1,11 @@
 import logging
 import time
 import sys
+import uuid
+import weakref
 import gevent
 import wishful_framework as msgs
+from .deadline_timer import DeadlineTimer
 
 __author__ = "Piotr Gawlowicz"
 __copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
@@ -10,6 +13,21 @@ __version__ = "0.1.0"
 __email__ = "gawlowicz@tkn.tu-berlin.de"
 
 
+#UPI capability states in Node lookup table, missing key means not supported
+UPI_SUPPORTED = 1
+UPI_GENERATOR = 2
+UPI_IFACE_FORBIDDEN = 3
+
+#liveness: answer every HelloMsg, or broadcast one HelloMsg per interval
+HELLO_MODE_REPLY = "reply"
+HELLO_MODE_BROADCAST = "broadcast"
+HELLO_BROADCAST_TOPIC = "ALL"
+
+#uplink subscriptions: one filter per agent, or everything with topic check
+SUBSCRIBE_NODE = "node"
+SUBSCRIBE_ALL = "all"
+
+
 class Group(object):
     def __init__(self, name):
         self.name = name
@@ -23,24 +41,39 @@ class Group(object):
         self.nodes.remove(node)
 
 
-class Node(object):
-    def __init__(self,msg):
-        self.log = logging.getLogger("{module}.{name}".format(
-            module=self.__class__.__module__, name=self.__class__.__name__))
-        self.id = str(msg.agent_uuid)
-        self.ip = str(msg.ip)
-        self.name = str(msg.name)
-        self.info = str(msg.info)
+class CapabilityProfile(object):
+    """Modules, functions, generators and interfaces announced by an agent.
+
+    Agents running the same module set share one profile, interned by the
+    serialized module and interface descriptions of NewNodeMsg. Profiles
+    are shared, so their dicts and lists must not be modified.
+    """
+    __slots__ = ("key", "modules", "functions", "generators", "interfaces",
+                 "iface_to_modules", "modules_without_iface", "upiTable", "__weakref__")
+
+    _profiles = weakref.WeakValueDictionary()
+
+    @classmethod
+    def intern(cls, msg):
+        key = (tuple(module.SerializeToString() for module in msg.modules),
+               tuple(iface.SerializeToString() for iface in msg.interfaces))
+        profile = cls._profiles.get(key, None)
+        if profile is None:
+            profile = cls(key, msg)
+            cls._profiles[key] = profile
+        return profile
+
+    @classmethod
+    def profile_num(cls):
+        return len(cls._profiles)
+
+    def __init__(self, key, msg):
+        self.key = key
         self.modules = {}
         self.functions = {}
         self.generators = {}
         self.interfaces = {}
         self.iface_to_modules = {}
-        self.modules_without_iface = []
-
-        self._stop = False
-        self._helloTimeout = 9
-        self._timerCallback = None
 
         for module in msg.modules:
             self.modules[module.id] = str(module.name)
@@ -65,13 +98,78 @@ class Node(object):
                 else:
                     self.iface_to_modules[iface.id] = [int(module.id)]
 
-        self.modules_without_iface = self.modules.copy()
+        modules_without_iface = self.modules.copy()
         for ifaceId, moduleIds in self.iface_to_modules.items():
             for moduleId in moduleIds:
                 moduleId = int(moduleId)
-                if moduleId in list(self.modules_without_iface.keys()):
-                    del self.modules_without_iface[moduleId]
-        self.modules_without_iface = list(self.modules_without_iface.keys())
+                modules_without_iface.pop(moduleId, None)
+        self.modules_without_iface = list(modules_without_iface.keys())
+
+        self.upiTable = self._build_upi_table()
+
+    def _add_module_upis(self, table, ifaceName, moduleIds, status=None):
+        #first module providing function decides, same as linear lookup
+        for moduleId in moduleIds:
+            for fname in self.functions.get(moduleId, []):
+                table.setdefault((ifaceName, fname), status or UPI_SUPPORTED)
+            for fname in self.generators.get(moduleId, []):
+                table.setdefault((ifaceName, fname), status or UPI_GENERATOR)
+
+    def _build_upi_table(self):
+        table = {}
+        self._add_module_upis(table, None, self.modules_without_iface)
+
+        seenIfaces = set()
+        for ifaceId, ifaceName in self.interfaces.items():
+            if ifaceName in seenIfaces:
+                #duplicated iface name, first one wins
+                continue
+            seenIfaces.add(ifaceName)
+            self._add_module_upis(table, ifaceName, self.iface_to_modules.get(ifaceId, []))
+            #functions without iface cannot be called with iface
+            self._add_module_upis(table, ifaceName, self.modules_without_iface, UPI_IFACE_FORBIDDEN)
+
+        return table
+
+
+class Node(object):
+    __slots__ = ("id", "ip", "name", "info", "profile", "_helloTimeout", "_helloTimer")
+
+    log = logging.getLogger("{}.Node".format(__name__))
+
+    def __init__(self,msg):
+        self.id = str(msg.agent_uuid)
+        self.ip = str(msg.ip)
+        self.name = str(msg.name)
+        self.info = str(msg.info)
+        self.profile = CapabilityProfile.intern(msg)
+
+        self._helloTimeout = 9
+        self._helloTimer = None
+
+    @property
+    def modules(self):
+        return self.profile.modules
+
+    @property
+    def functions(self):
+        return self.profile.functions
+
+    @property
+    def generators(self):
+        return self.profile.generators
+
+    @property
+    def interfaces(self):
+        return self.profile.interfaces
+
+    @property
+    def iface_to_modules(self):
+        return self.profile.iface_to_modules
+
+    @property
+    def modules_without_iface(self):
+        return self.profile.modules_without_iface
 
     def __str__(self):
         string = "ID: {} \nIP: {} \nName: {} \nInfo: {} \
@@ -86,19 +184,30 @@ class Node(object):
                     self.iface_to_modules, self.modules_without_iface)
         return string
 
-    def set_timer_callback(self, cb):
-        self._timerCallback = cb
-
-    def hello_timer(self):
-        while not self._stop and self._helloTimeout:
-            gevent.sleep(1)
-            self._helloTimeout = self._helloTimeout - 1
-
-        #remove node
-        self._timerCallback(self)
+    def to_msg(self):
+        #NewNodeMsg equivalent to the one node was created from
+        msg = msgs.NewNodeMsg()
+        msg.agent_uuid = self.id
+        msg.ip = self.ip
+        msg.name = self.name
+        msg.info = self.info
+
+        #modules and interfaces exactly as announced, with every field (e.g.
+        #module names of interfaces), so the node gets the same profile back
+        modulesData, ifacesData = self.profile.key
+        for data in modulesData:
+            msg.modules.add().ParseFromString(data)
+        for data in ifacesData:
+            msg.interfaces.add().ParseFromString(data)
+        return msg
+
+    def set_hello_timer(self, timer, timeout):
+        self._helloTimer = timer
+        self._helloTimeout = timeout
+        self.refresh_hello_timer()
 
     def refresh_hello_timer(self):
-        self._helloTimeout = 9
+        self._helloTimer.schedule(self.id, self._helloTimeout)
 
     def get_iface_id(self, name):
         for k,v in self.interfaces.items():
@@ -106,158 +215,404 @@ class Node(object):
                 return k
         return None
 
-
     def is_upi_supported(self, iface, upi_type, fname):
-        moduleIds = []
-
-        self.log.debug("Checking call: {}:{} for iface {} in node {}".format(upi_type,fname, iface, self.name))
-        if iface:
-            ifaceId = self.get_iface_id(str(iface))
-            moduleIds = self.iface_to_modules[ifaceId]
-        else:
-            moduleIds = self.modules_without_iface
-
-        for moduleId in moduleIds:
-            #check module functions
-            if moduleId in self.functions:
-                functions = self.functions[moduleId]
-                if fname in functions:
-                    return True
-
-            #check if function is generator
-            if moduleId in self.generators:
-                generators = self.generators[moduleId]
-                if fname in generators:
-                    raise Exception("UPI: {}:{} is generator in node: {}, please call with generator API".format(upi_type,fname, self.name))
+        status = self.profile.upiTable.get((iface or None, fname), None)
 
+        if status == UPI_SUPPORTED:
+            return True
 
-        #check if function requires iface
-        if iface:
-            for moduleId in self.modules_without_iface:
-                if moduleId in self.functions and fname in self.functions[moduleId]:
-                    raise Exception("UPI function: {}:{} cannot be called with iface in node: {}".format(upi_type,fname,self.name))
+        if status == UPI_GENERATOR:
+            raise Exception("UPI: {}:{} is generator in node: {}, please call with generator API".format(upi_type,fname, self.name))
 
-                if moduleId in self.generators and fname in self.generators[moduleId]:
-                    raise Exception("UPI function: {}:{} cannot be called with iface in node: {}".format(upi_type,fname,self.name))
+        if status == UPI_IFACE_FORBIDDEN:
+            raise Exception("UPI function: {}:{} cannot be called with iface in node: {}".format(upi_type,fname,self.name))
 
         raise Exception("UPI function: {}:{} not supported for iface: {} in node: {}, please install proper module".format(upi_type,fname,iface,self.name))
 
-        return False
-
 class NodeManager(object):
     def __init__(self, controller):
         self.log = logging.getLogger("{module}.{name}".format(
             module=self.__class__.__module__, name=self.__class__.__name__))
 
         self.controller = controller
-        self.nodes = []
         self.groups = []
 
+        #node indexes, insertion ordered; ip and name map to first node
+        self._nodesById = {}
+        self._nodesByIp = {}
+        self._nodesByName = {}
+
         self.newNodeCallbacks = []
+
+        #in sharded deployment only nodes accepted by filter are managed here
+        self.nodeFilter = None
+
+        #join storm mode: joins collected for joinWindow seconds (or up to
+        #joinBatchSize nodes) are subscribed, acked and announced at once
+        self.joinWindow = 0
+        self.joinBatchSize = 1000
+        self._pendingJoins = {}
+        self._joinFlusher = None
+
+        self._ackCmdDescFrame = None
+
+        self.subscriptionMode = SUBSCRIBE_NODE
         self.nodeExitCallbacks = []
 
         self.helloMsgInterval = 3
         self.helloTimeout = 3*self.helloMsgInterval
 
+        #one timer for hello timeouts of all nodes
+        self.helloTimer = DeadlineTimer(self._hello_timeout_expired, name="HelloTimer")
+
+        self.helloMode = HELLO_MODE_REPLY
+        self.helloBroadcaster = None
+        #nodes joined since last broadcast, they still get individual replies
+        self._helloReplyPending = set()
+        #serialized [cmdDesc, HelloMsg] frames and (uuid, helloTimeout) they were built for
+        self._helloFrames = None
+        self._helloFramesKey = None
+
+        #scratch control plane messages, parsed in place as only copied
+        #fields leave the handlers
+        self._newNodeMsg = msgs.NewNodeMsg()
+        self._nodeExitMsg = msgs.NodeExitMsg()
+        self._helloMsg = msgs.HelloMsg()
+
+    def stop(self):
+        self.helloTimer.stop()
+        self._stop_hello_broadcast()
+        if self._joinFlusher is not None:
+            self._joinFlusher.kill(block=False)
+            self._joinFlusher = None
+
+    def set_hello_mode(self, mode, interval=None):
+        if mode not in (HELLO_MODE_REPLY, HELLO_MODE_BROADCAST):
+            raise Exception("Unknown hello mode: {}".format(mode))
+
+        if mode == HELLO_MODE_BROADCAST and self.nodeFilter:
+            raise Exception("Hello mode: {} would reach agents of all shards".format(mode))
+
+        if interval:
+            self.helloMsgInterval = float(interval)
+            self.helloTimeout = 3*self.helloMsgInterval
+
+        self.log.debug("Hello mode: %s, interval: %s", mode, self.helloMsgInterval)
+        self.helloMode = mode
+        self._stop_hello_broadcast()
+        if mode == HELLO_MODE_BROADCAST:
+            self.helloBroadcaster = gevent.spawn(self._hello_broadcast_loop)
+
+    def _stop_hello_broadcast(self):
+        if self.helloBroadcaster:
+            self.helloBroadcaster.kill()
+            self.helloBroadcaster = None
+
     def add_new_node_callback(self, callback):
         self.newNodeCallbacks.append(callback)
 
     def add_node_exit_callback(self, callback):
         self.nodeExitCallbacks.append(callback)
 
+    def set_join_window(self, window, batchSize=None):
+        self.joinWindow = float(window)
+        if batchSize:
+            self.joinBatchSize = int(batchSize)
+        self.log.debug("Join window: %s s, batch size: %s", self.joinWindow, self.joinBatchSize)
+        if not self.joinWindow:
+            self.flush_joins()
+
+    def set_subscription_mode(self, mode):
+        """Either one SUB filter per node (default), or a single empty
+        prefix with received topics checked against known nodes, which
+        keeps filtering cost constant under churn.
+        """
+        if mode not in (SUBSCRIBE_NODE, SUBSCRIBE_ALL):
+            raise Exception("Unknown subscription mode: {}".format(mode))
+
+        if mode == SUBSCRIBE_ALL and self.nodeFilter:
+            raise Exception("Subscription mode: {} would receive traffic of all shards".format(mode))
+
+        self.log.debug("Subscription mode: %s", mode)
+        transport = self.controller.transport
+        nodeIds = list(self._nodesById.keys())
+        self.subscriptionMode = mode
+
+        if mode == SUBSCRIBE_ALL:
+            transport.set_topic_filter(self.accepts_topic)
+            transport.subscribe_to("")
+            transport.unsubscribe_from_topics(nodeIds)
+        else:
+            transport.subscribe_to_topics(nodeIds)
+            transport.unsubscribe_from("")
+            transport.set_topic_filter(None)
+
+    def accepts_topic(self, topic):
+        return topic in self._nodesById or topic in self.controller.transport.subscriptions
+
+    def set_node_filter(self, nodeFilter):
+        self.nodeFilter = nodeFilter
+
+    @property
+    def nodes(self):
+        return list(self._nodesById.values())
+
+    def _index_node(self, node):
+        self._nodesById[node.id] = node
+        self._nodesByIp.setdefault(node.ip, node)
+        self._nodesByName.setdefault(node.name, node)
+
+    def _unindex_node(self, node):
+        del self._nodesById[node.id]
+        for index, attr in ((self._nodesByIp, "ip"), (self._nodesByName, "name")):
+            key = getattr(node, attr)
+            if index.get(key) is not node:
+                continue
+            del index[key]
+            #promote next node sharing the key, rare so linear scan is fine
+            for n in self._nodesById.values():
+                if getattr(n, attr) == key:
+                    index[key] = n
+                    break
+
+    def is_node_known(self, node):
+        return self._nodesById.get(node.id) is node
+
     def get_node_by_id(self, nid):
-        node = None
-        for n in self.nodes:
-            if n.id == nid:
-                node = n;
-                break
-        return node 
+        return self._nodesById.get(nid, None)
 
 
     def get_node_by_ip(self, ip):
-        node = None
-        for n in self.nodes:
-            if n.ip == ip:
-                node = n;
-                break
-        return node
+        return self._nodesByIp.get(ip, None)
+
+
+    def get_node_by_name(self, name):
+        return self._nodesByName.get(name, None)
 
 
     def get_node_by_str(self, string):
         if isinstance(string, Node):
             return string
 
-        node = None
-        node = self.get_node_by_ip(string)
+        node = self._nodesByIp.get(string, None)
         if node:
             return node
 
-        node = self.get_node_by_id(string)
-        return node
+        node = self._nodesById.get(string, None)
+        if node:
+            return node
+
+        return self._nodesByName.get(string, None)
 
 
     def add_node(self, msgContainer):
         topic = msgContainer[0]
         cmdDesc = msgContainer[1]
-        msg = msgs.NewNodeMsg()
+        msg = self._newNodeMsg
+        msg.Clear()
         msg.ParseFromString(msgContainer[2])
         agentId = str(msg.agent_uuid)
         agentName = msg.name
         agentInfo = msg.info
         
-        for n in self.nodes:
-            if agentId == n.id:
-                self.log.debug("Already known Node UUID: {}, Name: {}, Info: {}".format(agentId,agentName,agentInfo))
-                return
+        node = self._nodesById.get(agentId, None)
+        if node:
+            #agent (re)connects, e.g. to controller restored from snapshot or
+            #after losing it, and waits for an ack
+            self.log.debug("Already known Node UUID: %s, Name: %s, Info: %s", agentId, agentName, agentInfo)
+            node.refresh_hello_timer()
+            self.send_node_ack(agentId, ["ALL"])
+            return node
+
+        if agentId in self._pendingJoins:
+            #ack is sent when the join window is flushed
+            return
+
+        if self.nodeFilter and not self.nodeFilter(agentId):
+            self.log.debug("Node UUID: %s belongs to other shard", agentId)
+            return
 
         node = Node(msg)
-        self.nodes.append(node)
-        self.log.debug("New node with UUID: {}, Name: {}, Info: {}".format(agentId,agentName,agentInfo))
-        self.controller.transport.subscribe_to(agentId)
+        self.log.debug("New node with UUID: %s, Name: %s, Info: %s", agentId, agentName, agentInfo)
+
+        if self.joinWindow:
+            self._pendingJoins[agentId] = node
+            if len(self._pendingJoins) >= self.joinBatchSize:
+                self.flush_joins()
+            elif self._joinFlusher is None:
+                self._joinFlusher = gevent.spawn_later(self.joinWindow, self.flush_joins)
+            return node
+
+        self._register_nodes([node])
+        return node
+
+
+    def flush_joins(self):
+        if self._joinFlusher is not None:
+            if self._joinFlusher is not gevent.getcurrent():
+                self._joinFlusher.kill(block=False)
+            self._joinFlusher = None
+
+        if not self._pendingJoins:
+            return
+
+        nodes = list(self._pendingJoins.values())
+        self._pendingJoins.clear()
+        self.log.debug("Register %s joined nodes", len(nodes))
+        self._register_nodes(nodes)
+
+
+    def restore_nodes(self, nodes):
+        #nodes from snapshot, agents already acked by previous run
+        self._register_nodes(nodes, ack=False)
 
-        #start hello timeout timer
-        node.set_timer_callback(self.remove_node_hello_timer)
-        gevent.spawn(node.hello_timer)
 
-        if node and self.newNodeCallbacks:
-            for cb in self.newNodeCallbacks:
-                #TODO: run in new thread in case there is loop insice callback
-                cb(node)
+    def _register_nodes(self, nodes, ack=True):
+        for node in nodes:
+            self._index_node(node)
+        if self.subscriptionMode == SUBSCRIBE_NODE:
+            self.controller.transport.subscribe_to_topics([node.id for node in nodes])
 
-        dest = agentId
-        cmdDesc.Clear()
-        cmdDesc.type = msgs.get_msg_type(msgs.NewNodeAck)
-        cmdDesc.func_name = msgs.get_msg_type(msgs.NewNodeAck)
-        cmdDesc.serialization_type = msgs.CmdDesc.PROTOBUF
+        for node in nodes:
+            #start hello timeout timer
+            node.set_hello_timer(self.helloTimer, self.helloTimeout)
+            if self.helloMode == HELLO_MODE_BROADCAST:
+                self._helloReplyPending.add(node.id)
+
+        if self.newNodeCallbacks:
+            if len(nodes) == 1:
+                for cb in self.newNodeCallbacks:
+                    self.controller.callbackDispatcher.dispatch_lifecycle(cb, nodes[0])
+            else:
+                #one queue entry per callback instead of per callback and node
+                for cb in self.newNodeCallbacks:
+                    self.controller.callbackDispatcher.dispatch_lifecycle(self._fire_for_nodes, cb, nodes)
+
+        if ack:
+            self.controller.transport.send_downlink_frames_batch(
+                [(node.id, self._node_ack_frames(node.id, ["ALL"])) for node in nodes])
+
+
+    def _fire_for_nodes(self, callback, nodes):
+        for node in nodes:
+            try:
+                callback(node)
+            except Exception as e:
+                self.log.exception("New node callback {} failed for node: {}: {}".format(callback, node.id, e))
+
+
+    def _node_ack_frames(self, agentId, topics):
+        #CmdDesc of NewNodeAck never changes, serialize it once
+        if self._ackCmdDescFrame is None:
+            cmdDesc = msgs.CmdDesc()
+            cmdDesc.type = msgs.get_msg_type(msgs.NewNodeAck)
+            cmdDesc.func_name = msgs.get_msg_type(msgs.NewNodeAck)
+            cmdDesc.serialization_type = msgs.CmdDesc.PROTOBUF
+            self._ackCmdDescFrame = cmdDesc.SerializeToString()
 
         msg = msgs.NewNodeAck()
         msg.status = True
         msg.controller_uuid = self.controller.uuid
         msg.agent_uuid = agentId
-        msg.topics.append("ALL")
+        msg.topics.extend(topics)
+        return [self._ackCmdDescFrame, msg.SerializeToString()]
 
-        msgContainer = [dest, cmdDesc, msg]
 
-        self.controller.transport.send_downlink_msg(msgContainer)
-        return node
+    def send_node_ack(self, agentId, topics):
+        #agent subscribes to all topics listed in NewNodeAck
+        self.controller.transport.send_downlink_frames(agentId, self._node_ack_frames(agentId, topics))
 
 
-    def remove_node_hello_timer(self, node):
-        reason = "HelloTimeout"
-        self.log.debug("Controller removes node with UUID: {}, Reason: {}".format(node.id, reason))
+    def create_group(self, name, nodes=[]):
+        if self.get_group_by_name(name):
+            raise Exception("Group: {} already exists".format(name))
+
+        group = Group(name)
+        self.groups.append(group)
+        self.log.debug("Created group: {}".format(name))
+
+        for node in nodes:
+            self.add_node_to_group(group, node)
+        return group
+
+
+    def get_group_by_name(self, name):
+        for g in self.groups:
+            if g.name == name:
+                return g
+        return None
+
+
+    def get_group_by_str(self, string):
+        if isinstance(string, Group):
+            return string
+        return self.get_group_by_name(string)
 
-        if node and node in self.nodes:
-            self.nodes.remove(node)
+
+    def remove_group(self, group):
+        group = self.get_group_by_str(group)
+        if group and group in self.groups:
+            self.groups.remove(group)
+
+
+    def add_node_to_group(self, group, node):
+        group = self.get_group_by_str(group)
+        node = self.get_node_by_str(node)
+        if not group or not node:
+            raise Exception("Cannot add node: {} to group: {}".format(node, group))
+
+        if node in group.nodes:
+            return
+
+        group.add_node(node)
+
+
+    def remove_node_from_group(self, group, node):
+        group = self.get_group_by_str(group)
+        node = self.get_node_by_str(node)
+        if not group or node not in group.nodes:
+            return
+
+        group.remove_node(node)
+
+
+    def _remove_node_from_groups(self, node):
+        for group in self.groups:
+            if node in group.nodes:
+                group.remove_node(node)
+
+
+    def _remove_node(self, node, reason):
+        if node and self.is_node_known(node):
+            self._unindex_node(node)
+            self.helloTimer.cancel(node.id)
+            self._helloReplyPending.discard(node.id)
+            if self.subscriptionMode == SUBSCRIBE_NODE:
+                self.controller.transport.unsubscribe_from(node.id)
+            self._remove_node_from_groups(node)
 
             if self.nodeExitCallbacks:
                 for cb in self.nodeExitCallbacks:
-                    cb(node, reason)
+                    self.controller.callbackDispatcher.dispatch_lifecycle(cb, node, reason)
+
+
+    def _hello_timeout_expired(self, nodeId):
+        node = self.get_node_by_id(nodeId)
+        if node:
+            self.remove_node_hello_timer(node)
+
+
+    def remove_node_hello_timer(self, node):
+        reason = "HelloTimeout"
+        self.log.debug("Controller removes node with UUID: %s, Reason: %s", node.id, reason)
+        self._remove_node(node, reason)
 
 
     def remove_node(self, msgContainer):
         topic = msgContainer[0]
         cmdDesc = msgContainer[1]
-        msg = msgs.NodeExitMsg()
+        msg = self._nodeExitMsg
+        msg.Clear()
         msg.ParseFromString(msgContainer[2])
         agentId = str(msg.agent_uuid)
         reason = msg.reason
@@ -265,41 +620,73 @@ class NodeManager(object):
         node = self.get_node_by_id(agentId)
 
         if not node:
+            #left before its join was registered
+            self._pendingJoins.pop(agentId, None)
             return
 
-        self.log.debug("Controller removes node with UUID: {}, Reason: {}".format(agentId, reason))
+        self.log.debug("Controller removes node with UUID: %s, Reason: %s", agentId, reason)
+        self._remove_node(node, reason)
 
-        if node and node in self.nodes:
-            self.nodes.remove(node)
 
-            if self.nodeExitCallbacks:
-                for cb in self.nodeExitCallbacks:
-                    cb(node, reason)
+    def get_hello_frames(self):
+        #HelloMsg of controller only changes with its uuid and helloTimeout, serialize it once
+        key = (self.controller.uuid, self.helloTimeout)
+        if self._helloFrames is None or self._helloFramesKey != key:
+            cmdDesc = msgs.CmdDesc()
+            cmdDesc.type = msgs.get_msg_type(msgs.HelloMsg)
+            cmdDesc.func_name = msgs.get_msg_type(msgs.HelloMsg)
+            cmdDesc.serialization_type = msgs.CmdDesc.PROTOBUF
+
+            msg = msgs.HelloMsg()
+            msg.uuid = str(self.controller.uuid)
+            msg.timeout = self.helloTimeout
+
+            self._helloFrames = [cmdDesc.SerializeToString(), msg.SerializeToString()]
+            self._helloFramesKey = key
+        return self._helloFrames
 
 
     def send_hello_msg_to_node(self, nodeId):
         self.log.debug("Controller sends HelloMsg to agent")
-        dest = nodeId
-        cmdDesc = msgs.CmdDesc()
-        cmdDesc.type = msgs.get_msg_type(msgs.HelloMsg)
-        cmdDesc.func_name = msgs.get_msg_type(msgs.HelloMsg)
-        cmdDesc.serialization_type = msgs.CmdDesc.PROTOBUF
+        self.controller.transport.send_downlink_frames(nodeId, self.get_hello_frames())
+
 
-        msg = msgs.HelloMsg()
-        msg.uuid = str(self.controller.uuid)
-        msg.timeout = self.helloTimeout
-        msgContainer = [dest, cmdDesc, msg]
-        self.controller.transport.send_downlink_msg(msgContainer)
+    def send_hello_broadcast(self):
+        self.log.debug("Controller broadcasts HelloMsg")
+        #nodes joined before this point are covered from now on
+        self._helloReplyPending.clear()
+        self.controller.transport.send_downlink_frames(HELLO_BROADCAST_TOPIC, self.get_hello_frames())
+
+
+    def send_hello_to_nodes(self):
+        #sharded controllers must not broadcast, agents of other shards listen too
+        self.log.debug("Controller sends HelloMsg to all its nodes")
+        frames = self.get_hello_frames()
+        self.controller.transport.send_downlink_frames_batch([(node.id, frames) for node in self.nodes])
+
+
+    def _hello_broadcast_loop(self):
+        while True:
+            self.send_hello_broadcast()
+            gevent.sleep(self.helloMsgInterval)
 
 
     def serve_hello_msg(self, msgContainer):
-        self.log.debug("Controller received HELLO MESSAGE from agent".format())
+        self.log.debug("Controller received HELLO MESSAGE from agent")
         dest = msgContainer[0]
         cmdDesc = msgContainer[1]
-        msg = msgs.HelloMsg()
+        msg = self._helloMsg
+        msg.Clear()
         msg.ParseFromString(msgContainer[2])
+        agentId = str(msg.uuid)
 
-        self.send_hello_msg_to_node(str(msg.uuid))
+        node = self.get_node_by_id(agentId)
+        if node:
+            node.refresh_hello_timer()
+
+        #with broadcast liveness known nodes already get the periodic HelloMsg
+        if self.helloMode == HELLO_MODE_BROADCAST and node and agentId not in self._helloReplyPending:
+            return
 
-        node = self.get_node_by_id(str(msg.uuid))
-        node.refresh_hello_timer()
+        self._helloReplyPending.discard(agentId)
+        self.send_hello_msg_to_node(agentId)
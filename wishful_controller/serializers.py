@@ -0,0 +1,209 @@
+import logging
+import dill #for pickling what standard pickle can’t cope with
+try:
+   import cPickle as pickle
+except:
+   import pickle
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+#pickle protocol 5 can move buffers (e.g. numpy arrays) out of band
+PICKLE_OOB_PROTOCOL = 5
+PICKLE_OOB = pickle.HIGHEST_PROTOCOL >= PICKLE_OOB_PROTOCOL
+
+
+class Serializer(object):
+    """Codec for payload frame of a message, selected by CmdDesc.serialization_type.
+
+    dumps_frames/loads_frames carry large buffers next to the payload as
+    extra multipart frames, so the receiver can use them without copying.
+    """
+    def can_encode(self, obj):
+        return True
+
+    def dumps(self, obj):
+        raise NotImplementedError
+
+    def loads(self, data, cmdDesc):
+        raise NotImplementedError
+
+    def dumps_frames(self, obj):
+        return self.dumps(obj), []
+
+    def loads_frames(self, data, buffers, cmdDesc):
+        return self.loads(data, cmdDesc)
+
+
+class PickleSerializer(Serializer):
+    def dumps(self, obj):
+        try:
+            return pickle.dumps(obj)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return dill.dumps(obj)
+
+    def loads(self, data, cmdDesc):
+        try:
+            return pickle.loads(data)
+        except Exception:
+            return dill.loads(data)
+
+    def dumps_frames(self, obj):
+        if not PICKLE_OOB:
+            return self.dumps(obj), []
+
+        buffers = []
+        try:
+            data = pickle.dumps(obj, protocol=PICKLE_OOB_PROTOCOL, buffer_callback=buffers.append)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return dill.dumps(obj), []
+        return data, [b.raw() for b in buffers]
+
+    def loads_frames(self, data, buffers, cmdDesc):
+        if not buffers:
+            return self.loads(data, cmdDesc)
+        return pickle.loads(data, buffers=buffers)
+
+
+class ProtobufSerializer(Serializer):
+    def __init__(self, resolve_class):
+        self.resolve_class = resolve_class
+
+    def can_encode(self, obj):
+        return hasattr(obj, "SerializeToString")
+
+    def dumps(self, obj):
+        return obj.SerializeToString()
+
+    def loads(self, data, cmdDesc):
+        if not cmdDesc.pb_full_name:
+            #serialized message parsed by its handler
+            return bytes(data)
+        return self.resolve_class(data, cmdDesc.pb_full_name)
+
+
+class MsgpackSerializer(Serializer):
+    """Fast codec for plain data: numbers, strings, bytes, lists, tuples,
+    dicts and numpy arrays, the latter packed as raw buffers.
+    """
+    EXT_TUPLE = 1
+    EXT_NDARRAY = 2
+    EXT_NDARRAY_FRAME = 3
+
+    #walking huge structures costs more than pickle saves
+    MAX_CHECKED_ITEMS = 10000
+
+    PLAIN_TYPES = (type(None), bool, int, float, str, bytes)
+
+    def __init__(self):
+        self.log = logging.getLogger("{module}.{name}".format(
+            module=self.__class__.__module__, name=self.__class__.__name__))
+
+    @staticmethod
+    def available():
+        return msgpack is not None
+
+    def can_encode(self, obj):
+        budget = [self.MAX_CHECKED_ITEMS]
+        return self._check(obj, budget)
+
+    def _check(self, obj, budget):
+        budget[0] = budget[0] - 1
+        if budget[0] < 0:
+            return False
+
+        objType = type(obj)
+        if objType in self.PLAIN_TYPES:
+            return True
+
+        if objType in (list, tuple):
+            for item in obj:
+                if not self._check(item, budget):
+                    return False
+            return True
+
+        if objType is dict:
+            for key, value in obj.items():
+                if not self._check(key, budget) or not self._check(value, budget):
+                    return False
+            return True
+
+        if numpy is not None and objType is numpy.ndarray:
+            return not obj.dtype.hasobject
+
+        return False
+
+    def _default(self, obj, buffers=None):
+        if isinstance(obj, tuple):
+            return msgpack.ExtType(self.EXT_TUPLE, self._pack(list(obj), buffers))
+
+        if numpy is not None and isinstance(obj, numpy.ndarray):
+            obj = numpy.ascontiguousarray(obj)
+            if buffers is None:
+                header = msgpack.packb([obj.dtype.str, obj.shape])
+                return msgpack.ExtType(self.EXT_NDARRAY, header + obj.tobytes())
+
+            #array data goes into its own frame, header keeps frame index
+            buffers.append(obj.data)
+            header = msgpack.packb([obj.dtype.str, obj.shape, len(buffers) - 1])
+            return msgpack.ExtType(self.EXT_NDARRAY_FRAME, header)
+
+        raise TypeError("Cannot serialize: {}".format(type(obj)))
+
+    def _ext_hook(self, code, data, buffers=None):
+        if code == self.EXT_TUPLE:
+            return tuple(self._unpack(data, buffers))
+
+        if code == self.EXT_NDARRAY:
+            unpacker = msgpack.Unpacker(use_list=True, raw=False)
+            unpacker.feed(data)
+            dtype, shape = unpacker.unpack()
+            offset = unpacker.tell()
+            return numpy.frombuffer(data, dtype=dtype, offset=offset).reshape(shape)
+
+        if code == self.EXT_NDARRAY_FRAME:
+            dtype, shape, index = msgpack.unpackb(data, raw=False)
+            return numpy.frombuffer(buffers[index], dtype=dtype).reshape(shape)
+
+        return msgpack.ExtType(code, data)
+
+    def _pack(self, obj, buffers=None):
+        return msgpack.packb(obj, use_bin_type=True, strict_types=True,
+                             default=lambda o: self._default(o, buffers))
+
+    def _unpack(self, data, buffers=None):
+        return msgpack.unpackb(data, raw=False, strict_map_key=False,
+                               ext_hook=lambda code, d: self._ext_hook(code, d, buffers))
+
+    def dumps(self, obj):
+        return self._pack(obj)
+
+    def loads(self, data, cmdDesc):
+        return self._unpack(data)
+
+    def dumps_frames(self, obj):
+        buffers = []
+        data = self._pack(obj, buffers)
+        return data, buffers
+
+    def loads_frames(self, data, buffers, cmdDesc):
+        return self._unpack(data, buffers)
+
+
+def decode_payload(serializer, data, buffers, cmdDesc):
+    if buffers:
+        return serializer.loads_frames(data, buffers, cmdDesc)
+    return serializer.loads(data, cmdDesc)
@@ -0,0 +1,378 @@
+import logging
+import zmq.green as zmq
+import gevent
+import wishful_framework as msgs
+from gevent.event import AsyncResult
+from gevent.lock import Semaphore
+
+from .node_manager import Node
+from .call_result import PartialResults
+from .serializers import PickleSerializer
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+#front waits this much longer than the call timeout for a shard to reply
+SHARD_REPLY_SLACK = 1.0
+
+
+class ShardServer(object):
+    """Control endpoint of a shard controller, used by ShardedController.
+
+    ROUTER socket serving pickled requests, each on its own greenlet so a
+    UPI call waiting for agents does not hold other requests:
+    ("nodes",) returns serialized NewNodeMsg of nodes owned by the shard,
+    ("exec_cmd", nodeIds, iface, timeout, upiType, fname, args, kwargs)
+    calls a UPI function on them and returns ({node id: result}, missing ids).
+    Replies are (True, value) or (False, error message).
+    """
+    def __init__(self, controller, endpoint):
+        self.log = logging.getLogger("{module}.{name}".format(
+            module=self.__class__.__module__, name=self.__class__.__name__))
+
+        self.controller = controller
+        self.endpoint = endpoint
+        self.serializer = PickleSerializer()
+        self.socket = None
+        self.socketLock = Semaphore()
+        self.receiver = None
+
+    def start(self):
+        self.log.debug("Shard control endpoint: %s", self.endpoint)
+        self.socket = self.controller.transport.context.socket(zmq.ROUTER)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.bind(self.endpoint)
+        self.receiver = gevent.spawn(self._receive)
+
+    def stop(self):
+        if self.receiver is not None:
+            self.receiver.kill()
+            self.receiver = None
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    def _receive(self):
+        while True:
+            identity, requestId, body = self.socket.recv_multipart()
+            gevent.spawn(self._serve, identity, requestId, body)
+
+    def _serve(self, identity, requestId, body):
+        try:
+            request = self.serializer.loads(body, None)
+            handler = getattr(self, "_serve_{}".format(request[0]), None)
+            if handler is None:
+                raise Exception("Unknown shard request: {}".format(request[0]))
+            reply = (True, handler(*request[1:]))
+        except Exception as e:
+            self.log.debug("Shard request failed: %s", e)
+            reply = (False, str(e))
+
+        self.socketLock.acquire()
+        try:
+            if self.socket is not None:
+                self.socket.send_multipart([identity, requestId, self.serializer.dumps(reply)])
+        finally:
+            self.socketLock.release()
+
+    def _serve_nodes(self):
+        return [node.to_msg().SerializeToString() for node in self.controller.nodeManager.nodes]
+
+    def _serve_exec_cmd(self, nodeIds, iface, timeout, upiType, fname, args, kwargs):
+        nodeManager = self.controller.nodeManager
+        nodes = [node for node in (nodeManager.get_node_by_id(nodeId) for nodeId in nodeIds) if node]
+        if not nodes:
+            return {}, list(nodeIds)
+
+        ctx = self.controller.nodes(nodes).future().timeout(timeout)
+        if iface:
+            ctx = ctx.iface(iface)
+        future = ctx.exec_cmd(upiType, fname, *args, **kwargs)
+        #ready, or expired by call table at timeout
+        future.asyncResult.wait()
+
+        results = dict((node.id, result) for node, result in future.results.items())
+        return results, [nodeId for nodeId in nodeIds if nodeId not in results]
+
+
+class ShardedNodeView(object):
+    """Read only NodeManager view over nodes of all shards.
+
+    Rebuilt from shard replies by ShardedController.refresh(); ip and name
+    map to the first node, shards in order of their endpoints.
+    """
+    def __init__(self):
+        self._nodesById = {}
+        self._nodesByIp = {}
+        self._nodesByName = {}
+        self._owners = {}
+
+    @property
+    def nodes(self):
+        return list(self._nodesById.values())
+
+    def update(self, nodesByShard):
+        #nodesByShard: [(shard, [node])]; keeps nodes already known
+        nodesById = {}
+        nodesByIp = {}
+        nodesByName = {}
+        owners = {}
+        for shard, nodes in nodesByShard:
+            for node in nodes:
+                nodesById[node.id] = node
+                nodesByIp.setdefault(node.ip, node)
+                nodesByName.setdefault(node.name, node)
+                owners[node.id] = shard
+        self._nodesById = nodesById
+        self._nodesByIp = nodesByIp
+        self._nodesByName = nodesByName
+        self._owners = owners
+
+    def is_node_known(self, node):
+        return self._nodesById.get(node.id) is node
+
+    def get_node_by_id(self, nid):
+        return self._nodesById.get(nid, None)
+
+    def get_node_by_ip(self, ip):
+        return self._nodesByIp.get(ip, None)
+
+    def get_node_by_name(self, name):
+        return self._nodesByName.get(name, None)
+
+    def get_node_by_str(self, string):
+        if isinstance(string, Node):
+            return string
+        return self._nodesByIp.get(string, None) or self._nodesById.get(string, None) \
+            or self._nodesByName.get(string, None)
+
+    def get_owner(self, node):
+        return self._owners.get(node.id, None)
+
+
+class _ShardClient(object):
+    #DEALER socket to ShardServer of one shard, replies matched by request id
+    def __init__(self, context, endpoint, serializer):
+        self.log = logging.getLogger("{module}.{name}".format(
+            module=self.__class__.__module__, name=self.__class__.__name__))
+
+        self.endpoint = endpoint
+        self.serializer = serializer
+        self.socket = context.socket(zmq.DEALER)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.connect(endpoint)
+        self.socketLock = Semaphore()
+        self.requestIdGen = 0
+        self.pending = {}
+        self.receiver = gevent.spawn(self._receive)
+
+    def close(self):
+        self.receiver.kill()
+        self.socket.close()
+        for asyncResult in self.pending.values():
+            asyncResult.set_exception(Exception("Shard: {} closed".format(self.endpoint)))
+        self.pending.clear()
+
+    def request(self, request, timeout=None):
+        self.requestIdGen = self.requestIdGen + 1
+        requestId = str(self.requestIdGen).encode("utf-8")
+        asyncResult = AsyncResult()
+        self.pending[requestId] = asyncResult
+
+        self.socketLock.acquire()
+        try:
+            self.socket.send_multipart([requestId, self.serializer.dumps(request)])
+        finally:
+            self.socketLock.release()
+
+        try:
+            ok, value = asyncResult.get(timeout=timeout)
+        except gevent.timeout.Timeout:
+            raise Exception("Shard: {} did not reply to: {} in {} s".format(self.endpoint, request[0], timeout))
+        finally:
+            self.pending.pop(requestId, None)
+
+        if not ok:
+            raise Exception("Shard: {} failed: {}".format(self.endpoint, value))
+        return value
+
+    def _receive(self):
+        while True:
+            requestId, body = self.socket.recv_multipart()
+            asyncResult = self.pending.get(requestId, None)
+            if asyncResult is None:
+                #caller gave up waiting
+                continue
+            try:
+                asyncResult.set(self.serializer.loads(body, None))
+            except Exception as e:
+                asyncResult.set_exception(e)
+
+
+class ShardedCall(object):
+    """UPI call on nodes of several shards, e.g.
+    sharded.nodes(nodes).iface("wlan0").timeout(5).radio.set_channel(6)
+
+    Nodes are split by owning shard, each shard gets one request and runs
+    one future call; results are merged into one dict (PartialResults if
+    some nodes did not answer in time or their shard is gone).
+    """
+    def __init__(self, sharded, nodes, iface=None, timeout=None):
+        self._sharded = sharded
+        self._nodes = nodes
+        self._iface = iface
+        self._timeout = timeout
+
+    def iface(self, iface):
+        return ShardedCall(self._sharded, self._nodes, iface, self._timeout)
+
+    def timeout(self, value):
+        return ShardedCall(self._sharded, self._nodes, self._iface, value)
+
+    def __getattr__(self, upiType):
+        if upiType.startswith("__"):
+            raise AttributeError(upiType)
+        return _ShardedUpi(self, upiType)
+
+    def exec_cmd(self, upi_type, fname, *args, **kwargs):
+        sharded = self._sharded
+        nodes = [sharded.resolve_node(node) for node in self._nodes]
+
+        byShard = {}
+        for node in nodes:
+            byShard.setdefault(sharded.nodeManager.get_owner(node), []).append(node)
+
+        replyTimeout = self._timeout + SHARD_REPLY_SLACK if self._timeout else None
+        requests = []
+        for shard, shardNodes in byShard.items():
+            request = ("exec_cmd", [node.id for node in shardNodes], self._iface, self._timeout,
+                       upi_type, fname, args, kwargs)
+            requests.append(gevent.spawn(shard.request, request, replyTimeout))
+        gevent.joinall(requests)
+
+        results = {}
+        errors = []
+        for greenlet in requests:
+            if greenlet.successful():
+                results.update(greenlet.value[0])
+            else:
+                errors.append(greenlet.exception)
+
+        if errors and not results:
+            raise errors[0]
+        for error in errors:
+            sharded.log.warning("Sharded call: %s:%s got no results from shard: %s", upi_type, fname, error)
+
+        results = dict((node, results[node.id]) for node in nodes if node.id in results)
+        for result in results.values():
+            if isinstance(result, Exception):
+                raise result
+
+        missing = [node for node in nodes if node not in results]
+        if missing:
+            return PartialResults(results, missing)
+        if len(nodes) == 1:
+            return results[nodes[0]]
+        return results
+
+
+class _ShardedUpi(object):
+    def __init__(self, call, upiType):
+        self._call = call
+        self._upiType = upiType
+
+    def __getattr__(self, fname):
+        if fname.startswith("__"):
+            raise AttributeError(fname)
+
+        def upi_function(*args, **kwargs):
+            return self._call.exec_cmd(self._upiType, fname, *args, **kwargs)
+        return upi_function
+
+
+class ShardedController(object):
+    """Front facade over shard controllers running in other processes.
+
+    Every shard controller exposes a control endpoint, e.g. config
+    {"shard": {"name": "shard_0", "shards": [...], "control": "tcp://*:8990"}}.
+    nodeManager is a view over nodes of all shards, refreshed every
+    refreshInterval seconds or by refresh(); UPI calls on nodes are sent
+    to their owning shards concurrently and results merged.
+    """
+    def __init__(self, controlEndpoints, refreshInterval=5, context=None):
+        self.log = logging.getLogger("{module}.{name}".format(
+            module=self.__class__.__module__, name=self.__class__.__name__))
+
+        self.controlEndpoints = list(controlEndpoints)
+        self.refreshInterval = refreshInterval
+        self.context = context or zmq.Context()
+        self.serializer = PickleSerializer()
+        self.shards = []
+        self.nodeManager = ShardedNodeView()
+        self._refresher = None
+
+    def start(self):
+        self.shards = [_ShardClient(self.context, endpoint, self.serializer)
+                       for endpoint in self.controlEndpoints]
+        self.refresh()
+        if self.refreshInterval:
+            self._refresher = gevent.spawn(self._refresh_periodically)
+
+    def stop(self):
+        if self._refresher is not None:
+            self._refresher.kill()
+            self._refresher = None
+        for shard in self.shards:
+            shard.close()
+        self.shards = []
+
+    def refresh(self, timeout=5):
+        requests = [gevent.spawn(shard.request, ("nodes",), timeout) for shard in self.shards]
+        gevent.joinall(requests)
+
+        nodesByShard = []
+        for shard, greenlet in zip(self.shards, requests):
+            if not greenlet.successful():
+                #keep last known nodes of shard that did not reply
+                self.log.warning("Node list of shard: %s not refreshed: %s", shard.endpoint, greenlet.exception)
+                nodes = [node for node in self.nodeManager.nodes if self.nodeManager.get_owner(node) is shard]
+                nodesByShard.append((shard, nodes))
+                continue
+
+            nodes = []
+            for data in greenlet.value:
+                msg = msgs.NewNodeMsg()
+                msg.ParseFromString(data)
+                node = self.nodeManager.get_node_by_id(str(msg.agent_uuid))
+                nodes.append(node if node is not None else Node(msg))
+            nodesByShard.append((shard, nodes))
+
+        self.nodeManager.update(nodesByShard)
+        return self.nodeManager.nodes
+
+    def _refresh_periodically(self):
+        while True:
+            gevent.sleep(self.refreshInterval)
+            try:
+                self.refresh()
+            except Exception as e:
+                self.log.error("Refreshing node view failed: {}".format(e))
+
+    def resolve_node(self, node):
+        #Node, uuid, ip or name; refresh once for nodes joined meanwhile
+        resolved = self.nodeManager.get_node_by_str(node)
+        if resolved is None or self.nodeManager.get_owner(resolved) is None:
+            self.refresh()
+            resolved = self.nodeManager.get_node_by_str(node if not isinstance(node, Node) else node.id)
+        if resolved is None or self.nodeManager.get_owner(resolved) is None:
+            raise Exception("Node: {} is not available".format(node))
+        return resolved
+
+    def node(self, node):
+        return ShardedCall(self, [node])
+
+    def nodes(self, nodelist):
+        return ShardedCall(self, list(nodelist))
@@ -0,0 +1,65 @@
+import logging
+import zmq
+from zmq.devices import ThreadDevice
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+class ShardForwarder(object):
+    """Single agent facing endpoint pair in front of shard controllers.
+
+    Agents connect to front uplink/downlink as to a single controller.
+    Subscriptions travel through XPUB/XSUB, so uplink messages of an agent
+    only reach the shard that subscribed to it, NEW_NODE reaches all shards
+    and each of them keeps only agents it owns.
+
+    Every shard controller runs in its own process (or host) with the same
+    "shard" config, e.g. {"name": "shard_0", "shards": ["shard_0", "shard_1"]},
+    and applications of a shard control only nodes owned by it; with a
+    "control" endpoint in that config a ShardedController in another process
+    controls nodes of all shards.
+    """
+    def __init__(self, uplink, downlink, shardEndpoints):
+        self.log = logging.getLogger("{module}.{name}".format(
+            module=self.__class__.__module__, name=self.__class__.__name__))
+
+        self.uplink = uplink
+        self.downlink = downlink
+        #[(shard uplink, shard downlink)]
+        self.shardEndpoints = list(shardEndpoints)
+        self.context = None
+        self.uplinkDevice = None
+        self.downlinkDevice = None
+
+    def start(self):
+        self.log.debug("Forwarder on DL-%s, UL-%s for %s shards", self.downlink, self.uplink, len(self.shardEndpoints))
+
+        #agents -> shards, shard controllers bind their uplink SUB sockets
+        self.uplinkDevice = ThreadDevice(zmq.FORWARDER, zmq.XSUB, zmq.XPUB)
+        self.uplinkDevice.bind_in(self.uplink)
+        for shardUplink, shardDownlink in self.shardEndpoints:
+            self.uplinkDevice.connect_out(shardUplink)
+
+        #shards -> agents
+        self.downlinkDevice = ThreadDevice(zmq.FORWARDER, zmq.XSUB, zmq.XPUB)
+        for shardUplink, shardDownlink in self.shardEndpoints:
+            self.downlinkDevice.connect_in(shardDownlink)
+        self.downlinkDevice.bind_out(self.downlink)
+
+        #own context, terminating it stops the device threads
+        self.context = zmq.Context()
+        for device in (self.uplinkDevice, self.downlinkDevice):
+            device.context_factory = lambda: self.context
+            device.setsockopt_in(zmq.LINGER, 0)
+            device.setsockopt_out(zmq.LINGER, 0)
+            device.start()
+
+    def stop(self):
+        if self.context is not None:
+            self.context.term()
+            self.context = None
+        self.uplinkDevice = None
+        self.downlinkDevice = None
@@ -0,0 +1,107 @@
+import logging
+import os
+import time
+try:
+   import cPickle as pickle
+except:
+   import pickle
+
+import wishful_framework as msgs
+from .node_manager import Node, Group
+from .hierarchical_control_module import LocalControlProgramDescriptor
+
+__author__ = "Piotr Gawlowicz"
+__copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
+__version__ = "0.1.0"
+__email__ = "gawlowicz@tkn.tu-berlin.de"
+
+
+SNAPSHOT_VERSION = 1
+
+
+class ControllerSnapshot(object):
+    """Controller state that lets a restarted controller route UPI calls
+    before agents rejoin: controller uuid, nodes (as serialized NewNodeMsg),
+    groups and local control program descriptors.
+    """
+    def __init__(self, controller):
+        self.log = logging.getLogger("{module}.{name}".format(
+            module=self.__class__.__module__, name=self.__class__.__name__))
+        self.controller = controller
+
+    def build(self):
+        nodeManager = self.controller.nodeManager
+        localPrograms = []
+        for agentUuid, programs in self.controller.hc.local_progs_by_node.items():
+            for program in programs:
+                localPrograms.append((agentUuid, program.id))
+
+        return {"version": SNAPSHOT_VERSION,
+                "time": time.time(),
+                "controller_uuid": self.controller.uuid,
+                "nodes": [node.to_msg().SerializeToString() for node in nodeManager.nodes],
+                "groups": [(group.name, group.uuid, [node.id for node in group.nodes])
+                           for group in nodeManager.groups],
+                "local_programs": localPrograms}
+
+    def save(self, path):
+        state = self.build()
+        #write next to target and rename, a crash never leaves half a snapshot
+        tmpPath = "{}.tmp".format(path)
+        with open(tmpPath, "wb") as f:
+            pickle.dump(state, f, protocol=2)
+        os.rename(tmpPath, path)
+        self.log.debug("Saved snapshot with %s nodes to %s", len(state["nodes"]), path)
+
+    def load(self, path):
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+
+        if state.get("version", None) != SNAPSHOT_VERSION:
+            raise Exception("Snapshot: {} has unsupported version: {}".format(path, state.get("version", None)))
+
+        self.restore(state)
+        return state
+
+    def restore(self, state):
+        controller = self.controller
+        nodeManager = controller.nodeManager
+
+        #agents accept HelloMsg only from controller that acked them
+        if state["controller_uuid"] != controller.uuid:
+            controller.transport.unsubscribe_from(controller.uuid)
+            controller.uuid = state["controller_uuid"]
+            controller.transport.subscribe_to(controller.uuid)
+
+        nodes = []
+        for data in state["nodes"]:
+            msg = msgs.NewNodeMsg()
+            msg.ParseFromString(data)
+            if nodeManager.get_node_by_id(str(msg.agent_uuid)):
+                continue
+            if nodeManager.nodeFilter and not nodeManager.nodeFilter(str(msg.agent_uuid)):
+                continue
+            nodes.append(Node(msg))
+        nodeManager.restore_nodes(nodes)
+
+        for name, groupUuid, nodeIds in state["groups"]:
+            if nodeManager.get_group_by_name(name):
+                continue
+            group = Group(name)
+            group.uuid = groupUuid
+            for nodeId in nodeIds:
+                node = nodeManager.get_node_by_id(nodeId)
+                if node:
+                    group.add_node(node)
+            nodeManager.groups.append(group)
+
+        hc = controller.hc
+        for agentUuid, programId in state["local_programs"]:
+            if not nodeManager.get_node_by_id(agentUuid):
+                continue
+            descriptor = LocalControlProgramDescriptor(hc, agentUuid, programId)
+            hc.local_progs_by_node.setdefault(agentUuid, []).append(descriptor)
+
+        self.log.info("Restored %s nodes and %s groups from snapshot taken at %s",
+                      len(nodes), len(state["groups"]), time.ctime(state["time"]))
+        return nodes
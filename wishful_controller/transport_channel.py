@@ -2,14 +2,14 @@ import logging
 import time
 import sys
 import zmq.green as zmq
+import gevent
 from importlib import import_module
 from gevent.lock import Semaphore
 import wishful_framework as msgs
-import dill #for pickling what standard pickle can’t cope with
-try:
-   import cPickle as pickle
-except:
-   import pickle
+from .serializers import PickleSerializer, ProtobufSerializer, MsgpackSerializer, decode_payload
+from .decode_offloader import DecodeOffloader
+from .metrics import Metrics
+from .deadline_timer import monotonic
 
 __author__ = "Piotr Gawlowicz"
 __copyright__ = "Copyright (c) 2015, Technische Universitat Berlin"
@@ -25,10 +25,31 @@ class TransportChannel(object):
         self.downlink = downlink
         self.uplink = uplink
         self.recv_callback = None
+        self.recv_batch_callback = None
+
+        #send large buffers (numpy arrays) as extra frames after payload
+        self.outOfBandBuffers = False
+
+        #max msgs handed to callback at once and max msgs drained per wakeup
+        self.recvBatchSize = 32
+        self.recvDrainLimit = 256
+
+        #optional decoding of large payloads off the hub thread, ordered per
+        #agent; scratch msgs tell agent of msgs on shared topics
+        self.decodeOffloader = None
+        self._controlMsgs = {"NEW_NODE": msgs.NewNodeMsg(), "NODE_EXIT": msgs.NodeExitMsg()}
+
+        #shared with controller, disabled unless enabled there
+        self.metrics = Metrics()
 
         self.context = zmq.Context()
         self.poller = zmq.Poller()
 
+        #topics subscribed on uplink, and optional check of received topics
+        #used when subscribed to everything
+        self.subscriptions = set(["NEW_NODE", "NODE_EXIT"])
+        self.topicFilter = None
+
         self.ul_socket = self.context.socket(zmq.SUB) # one SUB socket for uplink communication over topics
         if sys.version_info.major >= 3:
             self.ul_socket.setsockopt_string(zmq.SUBSCRIBE,  "NEW_NODE")
@@ -43,7 +64,21 @@ class TransportChannel(object):
         #register UL socket in poller
         self.poller.register(self.ul_socket, zmq.POLLIN)
 
+        #protobuf classes by pb_full_name, known message types are registered
+        #upfront so receive loop does not import on first message of a type
         self.importedPbClasses = {}
+        self.register_pb_module(msgs)
+
+        #payload codecs by CmdDesc.serialization_type, and the order in which
+        #select_serialization_type tries them, cheapest first
+        self.serializers = {}
+        self.serializerPreference = []
+        self.register_serializer(msgs.CmdDesc.PICKLE, PickleSerializer(), preferred=True)
+        self.register_serializer(msgs.CmdDesc.PROTOBUF, ProtobufSerializer(self.deserialize_protobuff))
+
+        msgpackType = getattr(msgs.CmdDesc, "MSGPACK", None)
+        if msgpackType is not None and MsgpackSerializer.available():
+            self.register_serializer(msgpackType, MsgpackSerializer(), preferred=True, position=0)
 
 
     def set_downlink(self, downlink):
@@ -56,33 +91,114 @@ class TransportChannel(object):
         self.uplink = uplink
 
 
-    def subscribe_to(self, topic):
-        self.log.debug("Controller subscribes to topic: {}".format(topic))
+    def _set_subscription(self, option, topic):
         if sys.version_info.major >= 3:
-            self.ul_socket.setsockopt_string(zmq.SUBSCRIBE, topic)
+            self.ul_socket.setsockopt_string(option, topic)
         else:
-            self.ul_socket.setsockopt(zmq.SUBSCRIBE, topic)
+            self.ul_socket.setsockopt(option, topic)
+
+
+    def subscribe_to(self, topic):
+        self.log.debug("Controller subscribes to topic: %s", topic)
+        if topic not in self.subscriptions:
+            self.subscriptions.add(topic)
+            self._set_subscription(zmq.SUBSCRIBE, topic)
  
 
+    def subscribe_to_topics(self, topics):
+        self.log.debug("Controller subscribes to %s topics", len(topics))
+        for topic in topics:
+            if topic not in self.subscriptions:
+                self.subscriptions.add(topic)
+                self._set_subscription(zmq.SUBSCRIBE, topic)
+
+
+    def unsubscribe_from(self, topic):
+        self.log.debug("Controller unsubscribes from topic: %s", topic)
+        if topic in self.subscriptions:
+            self.subscriptions.discard(topic)
+            self._set_subscription(zmq.UNSUBSCRIBE, topic)
+
+
+    def unsubscribe_from_topics(self, topics):
+        self.log.debug("Controller unsubscribes from %s topics", len(topics))
+        for topic in topics:
+            if topic in self.subscriptions:
+                self.subscriptions.discard(topic)
+                self._set_subscription(zmq.UNSUBSCRIBE, topic)
+
+
+    def set_topic_filter(self, topicFilter):
+        self.topicFilter = topicFilter
+
+
     def set_recv_callback(self, callback):
         self.recv_callback = callback
 
 
+    def set_recv_batch_callback(self, callback):
+        self.recv_batch_callback = callback
+
+
+    def set_recv_batching(self, batchSize=None, drainLimit=None):
+        if batchSize:
+            self.recvBatchSize = int(batchSize)
+        if drainLimit:
+            self.recvDrainLimit = int(drainLimit)
+        self.log.debug("Receive batch size: {}, drain limit: {}".format(self.recvBatchSize, self.recvDrainLimit))
+
+
+    def register_serializer(self, serializationType, serializer, preferred=False, position=None):
+        self.serializers[serializationType] = serializer
+        if serializationType in self.serializerPreference:
+            self.serializerPreference.remove(serializationType)
+
+        if preferred:
+            if position is None:
+                position = len(self.serializerPreference)
+            self.serializerPreference.insert(position, serializationType)
+
+
+    def select_serialization_type(self, msg):
+        for serializationType in self.serializerPreference:
+            if self.serializers[serializationType].can_encode(msg):
+                return serializationType
+        return msgs.CmdDesc.PICKLE
+
+
+    def set_out_of_band_buffers(self, value=True):
+        #agents have to understand more than 3 frames
+        self.outOfBandBuffers = value
+
+
+    def set_metrics(self, metrics):
+        self.metrics = metrics
+
+
+    def serialize_msg(self, cmdDesc, msg):
+        if self.metrics.enabled:
+            startTime = monotonic()
+
+        buffers = []
+        serializer = self.serializers.get(cmdDesc.serialization_type, None)
+        if serializer:
+            if self.outOfBandBuffers:
+                msg, buffers = serializer.dumps_frames(msg)
+            else:
+                msg = serializer.dumps(msg)
+
+        frames = [cmdDesc.SerializeToString(), msg] + buffers
+        if self.metrics.enabled:
+            self.metrics.serialized(monotonic() - startTime, sum(memoryview(f).nbytes for f in frames))
+        return frames
+
+
     def send_downlink_msg(self, msgContainer):
         msgContainer[0] = msgContainer[0].encode('utf-8')
         cmdDesc = msgContainer[1]
         msg = msgContainer[2]
 
-        if cmdDesc.serialization_type == msgs.CmdDesc.PICKLE:
-            try:
-                msg = pickle.dumps(msg)
-            except:
-                msg = dill.dumps(msg)
-        elif cmdDesc.serialization_type == msgs.CmdDesc.PROTOBUF:
-            msg = msg.SerializeToString()
-
-        msgContainer[1] = cmdDesc.SerializeToString()
-        msgContainer[2] = msg
+        msgContainer[1:] = self.serialize_msg(cmdDesc, msg)
 
         self.downlinkSocketLock.acquire()
         try:
@@ -90,10 +206,71 @@ class TransportChannel(object):
         finally:
             self.downlinkSocketLock.release()
 
+
+    def send_downlink_frames(self, dest, frames):
+        #frames already serialized, e.g. cached [cmdDesc, msg]
+        self.downlinkSocketLock.acquire()
+        try:
+            self.dl_socket.send_multipart([dest.encode('utf-8')] + frames, copy=False)
+        finally:
+            self.downlinkSocketLock.release()
+
+
+    def send_downlink_frames_batch(self, msgs):
+        #[(dest, frames)], sent under one lock acquisition
+        self.downlinkSocketLock.acquire()
+        try:
+            for dest, frames in msgs:
+                self.dl_socket.send_multipart([dest.encode('utf-8')] + frames, copy=False)
+        finally:
+            self.downlinkSocketLock.release()
+
+
+    def send_downlink_msg_batch(self, destinations, msgContainer):
+        #serialize once and reuse the same frames for every destination;
+        #zmq only bumps refcount of a Frame sent with copy=False
+        cmdDesc = msgContainer[0]
+        msg = msgContainer[1]
+
+        frames = [zmq.Frame(part) for part in self.serialize_msg(cmdDesc, msg)]
+        self.log.debug("Send downlink msg to %s destinations", len(destinations))
+
+        self.downlinkSocketLock.acquire()
+        try:
+            for dest in destinations:
+                self.dl_socket.send_multipart([dest.encode('utf-8')] + frames, copy=False)
+        finally:
+            self.downlinkSocketLock.release()
+
+    def register_pb_class(self, class_, typ=None):
+        if typ is None:
+            typ = "{}.{}".format(class_.__module__, class_.__name__)
+        self.importedPbClasses[typ] = class_
+
+
+    def register_pb_module(self, pyModule):
+        #register under defining module and under pyModule, as message
+        #classes are often re-exported (e.g. by wishful_framework)
+        for name in dir(pyModule):
+            class_ = getattr(pyModule, name, None)
+            if isinstance(class_, type) and hasattr(class_, "DESCRIPTOR") and hasattr(class_, "ParseFromString"):
+                self.register_pb_class(class_)
+                self.register_pb_class(class_, "{}.{}".format(pyModule.__name__, name))
+
+
+    def register_loaded_pb_modules(self):
+        #generated protobuf modules imported so far, e.g. by UPI modules
+        for name, pyModule in list(sys.modules.items()):
+            if pyModule is not None and name.endswith("_pb2"):
+                self.register_pb_module(pyModule)
+        self.log.debug("Registered %s protobuf message types", len(self.importedPbClasses))
+
+
     def deserialize_protobuff(self, message, typ):
         class_ = self.importedPbClasses.get(typ, None)
 
         if class_ is None:
+            self.log.debug("Import protobuf message type: %s", typ)
             module_, class_ = typ.rsplit('.', 1)
             class_ = getattr(import_module(module_), class_)
             self.importedPbClasses[typ] = class_
@@ -102,33 +279,124 @@ class TransportChannel(object):
         rv.ParseFromString(message)
         return rv
 
+    def set_decode_offloading(self, threshold=1024*1024, workers=4):
+        if self.decodeOffloader:
+            self.decodeOffloader.stop()
+        self.decodeOffloader = DecodeOffloader(self._deliver, int(threshold), int(workers))
+        self.log.debug("Offload decoding of payloads above {} bytes to {} threads".format(threshold, workers))
+
+
+    def recv_frames(self, flags=0):
+        #[topic, cmdDesc, payload, buffer, ...]; topic and cmdDesc are small
+        #and copied, payload and out of band buffers (e.g. numpy arrays) are
+        #memoryviews of zmq frames, codecs use them without copying
+        frames = [self.ul_socket.recv(flags)]
+        while self.ul_socket.getsockopt(zmq.RCVMORE):
+            if len(frames) < 2:
+                frames.append(self.ul_socket.recv())
+            else:
+                frames.append(self.ul_socket.recv(copy=False).buffer)
+        return frames
+
+
+    def parse_header(self, frames):
+        assert len(frames) >= 3, frames
+
+        cmdDesc = msgs.CmdDesc()
+        cmdDesc.ParseFromString(frames[1])
+        return frames[0].decode('utf-8'), cmdDesc, frames[2], frames[3:]
+
+
+    def parse_msg(self, frames):
+        if self.metrics.enabled:
+            startTime = monotonic()
+
+        dest, cmdDesc, msg, buffers = self.parse_header(frames)
+        size = len(msg)
+
+        serializer = self.serializers.get(cmdDesc.serialization_type, None)
+        if serializer:
+            msg = decode_payload(serializer, msg, buffers, cmdDesc)
+        else:
+            msg = bytes(msg)
+
+        if self.metrics.enabled:
+            self.metrics.deserialized(monotonic() - startTime, size + sum(len(b) for b in buffers))
+        return [dest, cmdDesc, msg]
+
+
+    def _agent_of(self, dest, cmdDesc, payload):
+        #NEW_NODE and NODE_EXIT topics are shared by all agents
+        if cmdDesc.caller_id:
+            return cmdDesc.caller_id
+
+        controlMsg = self._controlMsgs.get(dest, None)
+        if controlMsg is not None:
+            controlMsg.Clear()
+            controlMsg.ParseFromString(payload)
+            return str(controlMsg.agent_uuid)
+        return dest
+
+
+    def _offload_msg(self, frames, batch):
+        offloader = self.decodeOffloader
+        offload = offloader.should_offload(sum(len(f) for f in frames[2:]))
+        if not offload and not offloader.has_pending():
+            return False
+
+        dest, cmdDesc, payload, buffers = self.parse_header(frames)
+        agentId = self._agent_of(dest, cmdDesc, payload)
+        if not offload and not offloader.has_pending(agentId):
+            return False
+
+        #deliver what was received before, offloaded msg comes after it
+        if batch:
+            self._deliver(list(batch))
+            del batch[:]
+
+        serializer = self.serializers.get(cmdDesc.serialization_type, None)
+        offloader.submit(agentId, dest, cmdDesc, serializer, payload, buffers, offload and serializer is not None)
+        return True
+
+
+    def _deliver(self, batch):
+        if self.recv_batch_callback:
+            self.recv_batch_callback(batch)
+        else:
+            for msgContainer in batch:
+                self.recv_callback(msgContainer)
+
+
     def start_receiving(self):
         socks = dict(self.poller.poll())
         if self.ul_socket in socks and socks[self.ul_socket] == zmq.POLLIN:
-            try:
-                msgContainer = self.ul_socket.recv_multipart(zmq.NOBLOCK)
-            except zmq.ZMQError:
-                raise zmq.ZMQError
-
-            assert len(msgContainer) == 3, msgContainer
-
-            dest = msgContainer[0]
-            cmdDesc = msgs.CmdDesc()
-            cmdDesc.ParseFromString(msgContainer[1])
-            msg = msgContainer[2]
-            if cmdDesc.serialization_type == msgs.CmdDesc.PICKLE:
+            #drain socket until EAGAIN, but yield after drain limit
+            #so other greenlets are not starved under bursts
+            batch = []
+            msgNum = 0
+            while msgNum < self.recvDrainLimit:
                 try:
-                    msg = pickle.loads(msg)
-                except:
-                    msg = dill.loads(msg)
-            elif cmdDesc.serialization_type == msgs.CmdDesc.PROTOBUF:
-                if cmdDesc.pb_full_name:
-                    msg = self.deserialize_protobuff(msg, cmdDesc.pb_full_name)
+                    msgContainer = self.recv_frames(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+
+                msgNum = msgNum + 1
+                if self.topicFilter and not self.topicFilter(msgContainer[0].decode('utf-8')):
+                    continue
+
+                if self.decodeOffloader and self._offload_msg(msgContainer, batch):
+                    continue
+
+                batch.append(self.parse_msg(msgContainer))
+                if len(batch) >= self.recvBatchSize:
+                    self._deliver(batch)
+                    batch = []
+
+            if batch:
+                self._deliver(batch)
 
-            msgContainer[0] = dest.decode('utf-8')
-            msgContainer[1] = cmdDesc
-            msgContainer[2] = msg
-            self.recv_callback(msgContainer)
+            if msgNum >= self.recvDrainLimit:
+                gevent.sleep(0)
 
 
     def start(self):
@@ -138,6 +406,8 @@ class TransportChannel(object):
 
 
     def stop(self):
+        if self.decodeOffloader:
+            self.decodeOffloader.stop()
         self.ul_socket.setsockopt(zmq.LINGER, 0)
         self.dl_socket.setsockopt(zmq.LINGER, 0)
         self.ul_socket.close()